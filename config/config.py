@@ -55,6 +55,10 @@ class Config:
     # Location Search Configuration
     TOP_K_RESULTS = 10  # Số lượng điểm gần nhất trả về
     
+    # Route Building Configuration
+    # Số process build route (ProcessPoolExecutor tạo lúc startup); 0 = chạy trên threadpool của event loop
+    ROUTE_PROCESS_WORKERS = int(os.getenv("ROUTE_PROCESS_WORKERS", 0))
+    
     # Transportation Mode Configuration
     # H3 k-ring coverage (resolution 9, edge ~174m):
     # k=5: ~1.4km (91 cells), k=10: ~2.9km (331 cells), k=15: ~4.3km (721 cells)
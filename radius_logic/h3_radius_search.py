@@ -13,6 +13,9 @@ from utils.time_utils import TimeUtils
 from .route.route_config import RouteConfig
 import json
 
+# Độ → radian (giống math.radians nhưng không gọi hàm)
+_DEG_TO_RAD = math.pi / 180.0
+
 class H3RadiusSearch:
     """
     Tìm kiếm địa điểm sử dụng H3 hexagonal indexing và Redis cache (ASYNC)
@@ -52,13 +55,14 @@ class H3RadiusSearch:
         """
         R = 6371  # Bán kính trái đất (km)
         
-        lat1_rad = math.radians(lat1)
-        lat2_rad = math.radians(lat2)
-        delta_lat = math.radians(lat2 - lat1)
-        delta_lon = math.radians(lon2 - lon1)
+        lat1_rad = lat1 * _DEG_TO_RAD
+        lat2_rad = lat2 * _DEG_TO_RAD
+        delta_lat = (lat2 - lat1) * _DEG_TO_RAD
+        delta_lon = (lon2 - lon1) * _DEG_TO_RAD
         
         a = math.sin(delta_lat/2)**2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(delta_lon/2)**2
-        c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
+        # 2·asin(√a) ≡ 2·atan2(√a, √(1-a)) nhưng bớt 1 sqrt; min() chặn a > 1 do sai số làm tròn
+        c = 2 * math.asin(math.sqrt(min(1.0, a)))
         
         return R * c
     
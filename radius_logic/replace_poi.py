@@ -4,6 +4,7 @@ Xử lý logic cập nhật POI trong route: chọn POI mới, tính khoảng c
 """
 from typing import Optional, Dict, List, Any, Tuple
 from datetime import datetime
+from utils.time_utils import TimeUtils
 from radius_logic.route.geographic_utils import GeographicUtils
 from radius_logic.route.route_config import RouteConfig
 
@@ -41,7 +42,6 @@ class POIUpdateService:
         invalid_pois = []
         
         if current_datetime:
-            from utils.time_utils import TimeUtils
             for poi in candidate_pois:
                 open_hours = TimeUtils.normalize_open_hours(poi.get('open_hours'))
                 if TimeUtils.is_open_at_time(open_hours, current_datetime):
@@ -57,30 +57,23 @@ class POIUpdateService:
         
         # Nếu có reference_point thì tính combined score (distance + rating)
         if reference_point:
-            from radius_logic.route.route_config import RouteConfig
-            
             ref_lat, ref_lon = reference_point
             scored_pois = []
             
+            # Tính distance 1 lần cho mỗi POI có tọa độ (dùng cho cả max và score)
+            located = [
+                (poi, self.geo_utils.calculate_distance_haversine(
+                    ref_lat, ref_lon, poi['lat'], poi['lon']
+                ))
+                for poi in candidate_pois
+                if poi.get('lat') is not None and poi.get('lon') is not None
+            ]
+            
             # Tìm max distance để normalize
-            max_distance = 0
-            for poi in candidate_pois:
-                if poi.get('lat') is not None and poi.get('lon') is not None:
-                    dist = self.geo_utils.calculate_distance_haversine(
-                        ref_lat, ref_lon, poi['lat'], poi['lon']
-                    )
-                    max_distance = max(max_distance, dist)
+            max_distance = max((dist for _, dist in located), default=0)
             
             # Tính combined score cho từng POI
-            for poi in candidate_pois:
-                if poi.get('lat') is None or poi.get('lon') is None:
-                    continue
-                
-                # Tính distance
-                distance_km = self.geo_utils.calculate_distance_haversine(
-                    ref_lat, ref_lon, poi['lat'], poi['lon']
-                )
-                
+            for poi, distance_km in located:
                 # Normalize distance (đảo ngược: gần = điểm cao)
                 normalized_distance = distance_km / max_distance if max_distance > 0 else 0
                 distance_score = 1 - normalized_distance
@@ -101,7 +94,6 @@ class POIUpdateService:
             return [poi for poi, score in scored_pois[:n]]
         
         # Nếu không có reference_point, chọn theo rating cao nhất
-        from radius_logic.route.route_config import RouteConfig
         candidate_pois.sort(key=lambda p: -float(p.get('rating', RouteConfig.DEFAULT_RATING)))
         return candidate_pois[:n]
     
@@ -179,8 +171,6 @@ class POIUpdateService:
         Returns:
             Dict chứa thông tin thay đổi thời gian
         """
-        from radius_logic.route.route_config import RouteConfig
-        
         # Sử dụng speeds từ RouteConfig
         speed = RouteConfig.TRANSPORTATION_SPEEDS.get(transportation_mode.upper(), 40)
         time_changes = {}
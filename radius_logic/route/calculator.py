@@ -2,12 +2,45 @@
 Score Calculator
 Logic tính điểm kết hợp cho POI
 """
-from typing import List, Dict, Any, Tuple, Optional
+import functools
+from typing import List, Dict, Any, Tuple, Optional, NamedTuple
+import numpy as np
 from .route_config import RouteConfig
 from .geographic_utils import GeographicUtils
+from .kernels import lat_trig_tables
+
+
+def _weight_tuple(weights: Dict[str, float]) -> Tuple[float, float, float, float]:
+    """Dict weights → tuple (distance, similarity, rating, bearing) để tránh dict lookup"""
+    return (
+        weights["distance"],
+        weights["similarity"],
+        weights["rating"],
+        weights.get("bearing", 0.0)
+    )
+
+
+_FIRST_W = _weight_tuple(RouteConfig.FIRST_POI_WEIGHTS)
+_LAST_W = _weight_tuple(RouteConfig.LAST_POI_WEIGHTS)
+_MIDDLE_HIGH_W = _weight_tuple(RouteConfig.MIDDLE_POI_WEIGHTS_HIGH_SIMILARITY)
+_MIDDLE_LOW_W = _weight_tuple(RouteConfig.MIDDLE_POI_WEIGHTS_LOW_SIMILARITY)
+_SIMILARITY_THRESHOLD = RouteConfig.SIMILARITY_THRESHOLD
+
+
+class PlaceArrays(NamedTuple):
+    """Các thuộc tính số của POI dạng cột (theo index trong places), build 1 lần mỗi build_routes"""
+    scores: np.ndarray
+    ratings: np.ndarray
+    lats: np.ndarray
+    lons: np.ndarray
+    stay_times: np.ndarray  # stay_time gốc (chưa trừ stay_time_reduction)
+    sin_lats: np.ndarray    # sin(vĩ độ) - dùng cho bearing, tính 1 lần thay vì mỗi bước greedy
+    cos_lats: np.ndarray    # cos(vĩ độ)
 
 class Calculator:
 
+    __slots__ = ("geo", "stay_time_reduction")
+
     def __init__(self, geographic_utils: GeographicUtils):
         self.geo = geographic_utils
         # Số phút trừ vào stay_time khi build_routes kích hoạt fallback.
@@ -15,7 +48,27 @@ class Calculator:
         # giá trị này lên 10 phút mỗi vòng khi 5 route đều < 3 POI.
         self.stay_time_reduction: float = 0.0
 
-    def calculate_travel_time(self, distance_km: float, transportation_mode: str) -> float:
+    @staticmethod
+    @functools.lru_cache(maxsize=None)
+    def get_minutes_per_km(transportation_mode: str) -> float:
+        """
+        Số phút cần để di chuyển 1 km với phương tiện đã chọn
+        
+        Tra TRANSPORTATION_SPEEDS 1 lần cho mỗi lần build route, sau đó
+        travel time = distance_km * minutes_per_km (không lookup trong vòng lặp).
+        Chỉ có vài phương tiện → memoize theo transportation_mode.
+        
+        Args:
+            transportation_mode: Phương tiện
+            
+        Returns:
+            Phút / km
+        """
+        speed = RouteConfig.TRANSPORTATION_SPEEDS.get(transportation_mode.upper(), 30)
+        return 60.0 / speed  # Chuyển giờ sang phút
+    
+    @staticmethod
+    def calculate_travel_time(distance_km: float, transportation_mode: str) -> float:
         """
         Tính thời gian di chuyển (phút)
         
@@ -26,16 +79,22 @@ class Calculator:
         Returns:
             Thời gian (phút)
         """
-        speed = RouteConfig.TRANSPORTATION_SPEEDS.get(transportation_mode.upper(), 30)
-        return (distance_km / speed) * 60  # Chuyển giờ sang phút
+        return distance_km * Calculator.get_minutes_per_km(transportation_mode)
     
-    def get_stay_time(self, poi_type: str, stay_time: Optional[float] = None) -> float:
-        if stay_time is not None:
-            try:
-                return float(stay_time)
-            except (TypeError, ValueError):
-                pass
-        return RouteConfig.DEFAULT_STAY_TIME
+    @staticmethod
+    def get_stay_time(poi_type: str, stay_time: Optional[float] = None) -> float:
+        if stay_time is None:
+            return RouteConfig.DEFAULT_STAY_TIME
+        # Fast path cho kiểu số thường gặp (không cần try/except)
+        stay_type = type(stay_time)
+        if stay_type is float:
+            return stay_time
+        if stay_type is int:
+            return float(stay_time)
+        try:
+            return float(stay_time)
+        except (TypeError, ValueError):
+            return RouteConfig.DEFAULT_STAY_TIME
 
     def get_stay_time_reduction(self, poi_type: str, stay_time: Optional[float] = None) -> float:
         """
@@ -60,120 +119,76 @@ class Calculator:
         base = self.get_stay_time(poi_type, stay_time)
         return max(base - self.stay_time_reduction, 0.0)
 
-    def calculate_combined_score(
-        self,
-        place_idx: int,
-        current_pos: int,
-        places: List[Dict[str, Any]],
-        distance_matrix: List[List[float]],
-        max_distance: float,
-        is_first: bool = False,
-        is_last: bool = False,
-        start_pos_index: Optional[int] = None,
-        prev_bearing: Optional[float] = None,
-        user_location: Optional[Tuple[float, float]] = None
-    ) -> float:
+    def stay_time_at(self, place_arrays: PlaceArrays, place_idx: int) -> float:
+        """get_stay_time_reduction của 1 POI, đọc stay_time gốc đã parse sẵn trong place_arrays"""
+        return max(float(place_arrays.stay_times[place_idx]) - self.stay_time_reduction, 0.0)
+
+    @staticmethod
+    def build_place_arrays(places: List[Dict[str, Any]]) -> PlaceArrays:
         """
-        Tính điểm kết hợp: distance + similarity + rating + bearing (hướng)
-        
-        Công thức:
-        - POI đầu: 0.1*distance + 0.45*similarity + 0.45*rating
-        - POI giữa: thêm yếu tố bearing để tránh zíc zắc
-          + Nếu similarity >= 0.8: 0.15*distance + 0.5*similarity + 0.3*rating + 0.05*bearing
-          + Nếu similarity < 0.8:  0.25*distance + 0.1*similarity + 0.4*rating + 0.25*bearing
-        - POI cuối: ưu tiên gần user (0.4*distance + 0.3*similarity + 0.3*rating)
+        Gom similarity, rating, tọa độ (kèm sin/cos vĩ độ) và stay_time của tất cả POI thành các mảng NumPy
+        (tính 1 lần mỗi build_routes, vòng chọn POI không phải đọc dict)
         
         Args:
-            place_idx: Index địa điểm cần tính (0-based trong places list)
-            current_pos: Vị trí hiện tại (0 = user, 1-n = places)
             places: Danh sách địa điểm
-            distance_matrix: Ma trận khoảng cách
-            max_distance: Khoảng cách tối đa để normalize
-            is_first: Có phải POI đầu tiên không
-            is_last: Có phải POI cuối cùng không
-            prev_bearing: Hướng di chuyển trước đó (cho POI giữa)
-            user_location: Tọa độ user (lat, lon) để tính bearing
             
         Returns:
-            Combined score (cao hơn = tốt hơn)
+            PlaceArrays - float64, theo index trong places
         """
-        place = places[place_idx]
-        
-        # similarity (score từ Qdrant, đã normalize 0-1)
-        similarity = place["score"]
-        
-        # rating (normalize_stars_reviews từ DB, đã normalize 0-1)
-        rating = float(place.get("rating") or RouteConfig.DEFAULT_RATING)
-        
-        # Nếu là POI cuối, tính khoảng cách từ place đến user (index 0)
-        # Ngược lại tính khoảng cách từ current_pos đến place
-        if is_last:
-            distance_km = distance_matrix[place_idx + 1][0]  # Khoảng cách place -> user
-        else:
-            distance_km = distance_matrix[current_pos][place_idx + 1]  # Khoảng cách current -> place
-        
-        # Normalize distance (đảo ngược: gần = điểm cao)
+        n = len(places)
+        scores = np.fromiter((p["score"] for p in places), dtype=np.float64, count=n)
+        ratings = np.fromiter(
+            (float(p.get("rating") or RouteConfig.DEFAULT_RATING) for p in places),
+            dtype=np.float64, count=n
+        )
+        lats = np.fromiter((p["lat"] for p in places), dtype=np.float64, count=n)
+        lons = np.fromiter((p["lon"] for p in places), dtype=np.float64, count=n)
+        stay_times = np.fromiter(
+            (Calculator.get_stay_time(p.get("poi_type", ""), p.get("stay_time")) for p in places),
+            dtype=np.float64, count=n
+        )
+        sin_lats, cos_lats = lat_trig_tables(lats)
+        return PlaceArrays(scores, ratings, lats, lons, stay_times, sin_lats, cos_lats)
+    
+    def stay_time_array(self, place_arrays: PlaceArrays) -> np.ndarray:
+        """get_stay_time_reduction cho tất cả POI (vector hóa)"""
+        return np.maximum(place_arrays.stay_times - self.stay_time_reduction, 0.0)
+    
+    @staticmethod
+    def distance_score(distance_km: float, max_distance: float) -> float:
+        """Normalize distance (đảo ngược: gần = điểm cao)"""
         normalized_distance = distance_km / max_distance if max_distance > 0 else 0
-        distance_score = 1 - normalized_distance
-        
-        # Tính bearing score (chỉ cho POI giữa)
-        bearing_score = RouteConfig.DEFAULT_BEARING_SCORE  # Mặc định trung tính
-        if not is_first and not is_last and prev_bearing is not None and user_location:
-            # Lấy tọa độ điểm hiện tại và điểm tiếp theo
-            if current_pos == 0:  # Từ user
-                current_lat, current_lon = user_location
-            else:
-                current_place = places[current_pos - 1]
-                current_lat, current_lon = current_place["lat"], current_place["lon"]
-            
-            next_place = places[place_idx]
-            next_lat, next_lon = next_place["lat"], next_place["lon"]
-            
-            # Tính hướng từ điểm hiện tại đến điểm tiếp theo
-            current_bearing = self.geo.calculate_bearing(current_lat, current_lon, next_lat, next_lon)
-            
-            # Tính độ chênh lệch góc (0-180)
-            bearing_diff = self.geo.calculate_bearing_difference(prev_bearing, current_bearing)
-            
-            # Chuyển thành điểm: 0° (cùng hướng) = 1.0, 180° (ngược hướng) = 0.0
-            bearing_score = 1.0 - (bearing_diff / 180.0)
-        
-        # Tính combined score theo công thức
-        if is_first:
-            # POI đầu: 0.1*distance + 0.45*similarity + 0.45*rating
-            weights = RouteConfig.FIRST_POI_WEIGHTS
-            combined = (
-                weights["distance"] * distance_score +
-                weights["similarity"] * similarity +
-                weights["rating"] * rating
-            )
-        elif is_last:
-            # POI cuối: ưu tiên gần user
-            weights = RouteConfig.LAST_POI_WEIGHTS
-            combined = (
-                weights["distance"] * distance_score +
-                weights["similarity"] * similarity +
-                weights["rating"] * rating
-            )
+        return 1 - normalized_distance
+    
+    @staticmethod
+    def score_first(distance_score: float, similarity: float, rating: float) -> float:
+        """Combined score POI đầu: distance + similarity + rating (FIRST_POI_WEIGHTS)"""
+        w_distance, w_similarity, w_rating, _ = _FIRST_W
+        return w_distance * distance_score + w_similarity * similarity + w_rating * rating
+    
+    @staticmethod
+    def score_last(distance_score: float, similarity: float, rating: float) -> float:
+        """Combined score POI cuối: ưu tiên gần user (distance_score tính theo khoảng cách về user)"""
+        w_distance, w_similarity, w_rating, _ = _LAST_W
+        return w_distance * distance_score + w_similarity * similarity + w_rating * rating
+    
+    @staticmethod
+    def score_middle(
+        distance_score: float,
+        similarity: float,
+        rating: float,
+        bearing_score: float = RouteConfig.DEFAULT_BEARING_SCORE
+    ) -> float:
+        """Combined score POI giữa: thêm bearing để tránh zíc zắc, weights chọn theo similarity"""
+        if similarity >= _SIMILARITY_THRESHOLD:
+            w_distance, w_similarity, w_rating, w_bearing = _MIDDLE_HIGH_W
         else:
-            # POI giữa: thêm yếu tố bearing để tránh zíc zắc
-            if similarity >= RouteConfig.SIMILARITY_THRESHOLD:
-                weights = RouteConfig.MIDDLE_POI_WEIGHTS_HIGH_SIMILARITY
-                combined = (
-                weights["distance"] * distance_score +
-                weights["similarity"] * similarity +
-                weights["rating"] * rating +
-                weights["bearing"] * bearing_score
-            )
-            else:
-                weights = RouteConfig.MIDDLE_POI_WEIGHTS_LOW_SIMILARITY
-                combined = (
-                weights["distance"] * distance_score +
-                weights["similarity"] * similarity +
-                weights["rating"] * rating +
-                weights["bearing"] * bearing_score
-            )
-        
-        return combined
+            w_distance, w_similarity, w_rating, w_bearing = _MIDDLE_LOW_W
+        return (
+            w_distance * distance_score +
+            w_similarity * similarity +
+            w_rating * rating +
+            w_bearing * bearing_score
+        )
 
     
\ No newline at end of file
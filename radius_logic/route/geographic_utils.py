@@ -3,11 +3,96 @@ Geographic Utilities
 Các hàm tính toán địa lý: distance, bearing, etc.
 """
 import math
+import functools
 from typing import List, Tuple, Dict, Any
+import numpy as np
 from .route_config import RouteConfig
+from .kernels import DEG_TO_RAD, RAD_TO_DEG
+
+
+def _haversine_pairs(
+    lat1: np.ndarray, lon1: np.ndarray, lat2: np.ndarray, lon2: np.ndarray
+) -> np.ndarray:
+    """Khoảng cách Haversine (km) giữa từng cặp điểm (lat1[k], lon1[k]) → (lat2[k], lon2[k])"""
+    lat1_rad = np.radians(lat1)
+    lat2_rad = np.radians(lat2)
+    delta_lat = np.radians(lat2 - lat1)
+    delta_lon = np.radians(lon2 - lon1)
+    
+    a = np.sin(delta_lat / 2) ** 2 + np.cos(lat1_rad) * np.cos(lat2_rad) * np.sin(delta_lon / 2) ** 2
+    # min() chặn a > 1 do sai số làm tròn (điểm gần đối cực) → arcsin không ra NaN
+    c = 2 * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+    return RouteConfig.EARTH_RADIUS_KM * c
+
+
+def _haversine_matrix(coords: Tuple[Tuple[float, float], ...]) -> np.ndarray:
+    """
+    Ma trận khoảng cách Haversine (km) giữa tất cả các điểm trong coords
+    
+    Chỉ tính nửa trên (i < j) bằng Haversine vector hóa, sau đó đối xứng sang nửa dưới
+    """
+    points = np.array(coords, dtype=np.float64).reshape(-1, 2)
+    lats = points[:, 0]
+    lons = points[:, 1]
+    
+    iu, ju = np.triu_indices(len(points), k=1)
+    matrix = np.zeros((len(points), len(points)), dtype=np.float64)
+    matrix[iu, ju] = _haversine_pairs(lats[iu], lons[iu], lats[ju], lons[ju])
+    matrix += matrix.T  # Ma trận đối xứng
+    return matrix
+
+
+@functools.lru_cache(maxsize=128)
+def _cached_places_matrix(
+    place_coords: Tuple[Tuple[float, float], ...]
+) -> Tuple[np.ndarray, float]:
+    """
+    Cache LRU cho ma trận khoảng cách giữa các place (không gồm user) và max của nó
+    
+    Phần O(n²) chỉ phụ thuộc danh sách places → dùng lại được khi cùng tập POI
+    nhưng user_location thay đổi (user di chuyển, GPS lệch vài mét).
+    """
+    matrix = _haversine_matrix(place_coords)
+    matrix.setflags(write=False)
+    return matrix, float(matrix.max()) if matrix.size else 0.0
+
+
+@functools.lru_cache(maxsize=256)
+def _cached_distance_info(
+    coords: Tuple[Tuple[float, float], ...]
+) -> Tuple[np.ndarray, float, float]:
+    """
+    Cache LRU cho (distance_matrix, max_distance, max_radius)
+    
+    Key = tọa độ user + tọa độ từng place (đúng thứ tự), nên cùng user_location và
+    cùng danh sách places sẽ không phải tính lại O(n²) Haversine. Khi chỉ user_location
+    đổi, phần places × places lấy từ _cached_places_matrix, chỉ tính lại hàng user (O(n)).
+    Ma trận được đánh dấu read-only vì dùng chung giữa các request.
+    """
+    n = len(coords) - 1
+    places_matrix, places_max = _cached_places_matrix(coords[1:])
+    
+    points = np.array(coords, dtype=np.float64).reshape(-1, 2)
+    user_row = _haversine_pairs(
+        np.full(n, points[0, 0]), np.full(n, points[0, 1]), points[1:, 0], points[1:, 1]
+    )
+    
+    matrix = np.empty((n + 1, n + 1), dtype=np.float64)
+    matrix[0, 0] = 0.0
+    matrix[0, 1:] = user_row
+    matrix[1:, 0] = user_row
+    matrix[1:, 1:] = places_matrix
+    matrix.setflags(write=False)
+    
+    max_radius = float(user_row.max()) if n else 0.0
+    max_distance = max(places_max, max_radius)
+    return matrix, max_distance, max_radius
+
 
 class GeographicUtils:
 
+    __slots__ = ()
+
     @staticmethod
     def calculate_distance_haversine(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
         """
@@ -24,13 +109,14 @@ class GeographicUtils:
         """
         R = RouteConfig.EARTH_RADIUS_KM  # Bán kính trái đất (km)
         
-        lat1_rad = math.radians(lat1)
-        lat2_rad = math.radians(lat2)
-        delta_lat = math.radians(lat2 - lat1)
-        delta_lon = math.radians(lon2 - lon1)
+        lat1_rad = lat1 * DEG_TO_RAD
+        lat2_rad = lat2 * DEG_TO_RAD
+        delta_lat = (lat2 - lat1) * DEG_TO_RAD
+        delta_lon = (lon2 - lon1) * DEG_TO_RAD
         
         a = math.sin(delta_lat/2)**2 + math.cos(lat1_rad) * math.cos(lat2_rad) * math.sin(delta_lon/2)**2
-        c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
+        # min() chặn a > 1 do sai số làm tròn (điểm gần đối cực) → asin không lỗi math domain
+        c = 2 * math.asin(math.sqrt(min(1.0, a)))
         
         return R * c
 
@@ -48,15 +134,15 @@ class GeographicUtils:
         Returns:
             Bearing (độ, 0-360)
         """
-        lat1_rad = math.radians(lat1)
-        lat2_rad = math.radians(lat2)
-        delta_lon = math.radians(lon2 - lon1)
+        lat1_rad = lat1 * DEG_TO_RAD
+        lat2_rad = lat2 * DEG_TO_RAD
+        delta_lon = (lon2 - lon1) * DEG_TO_RAD
         
         x = math.sin(delta_lon) * math.cos(lat2_rad)
         y = math.cos(lat1_rad) * math.sin(lat2_rad) - math.sin(lat1_rad) * math.cos(lat2_rad) * math.cos(delta_lon)
         
         bearing_rad = math.atan2(x, y)
-        bearing_deg = math.degrees(bearing_rad)
+        bearing_deg = bearing_rad * RAD_TO_DEG
         
         # Chuyển về 0-360
         return (bearing_deg + 360) % 360
@@ -79,35 +165,47 @@ class GeographicUtils:
             diff = 360 - diff
         return diff
 
+    @staticmethod
     def build_distance_matrix(
-        self,
         user_location: Tuple[float, float],
         places: List[Dict[str, Any]]
-    ) -> List[List[float]]:
+    ) -> np.ndarray:
         """
-        Xây dựng ma trận khoảng cách sử dụng Haversine (NHANH)
+        Xây dựng ma trận khoảng cách sử dụng Haversine (NHANH, vector hóa NumPy)
         
         Args:
             user_location: (lat, lon) của user
             places: Danh sách địa điểm
             
         Returns:
-            Ma trận khoảng cách [n+1][n+1] (index 0 là user)
+            Ma trận khoảng cách float64 shape (n+1, n+1) (index 0 là user)
         """
-        n = len(places)
-        matrix = [[0.0] * (n + 1) for _ in range(n + 1)]
-        
-        # Tọa độ tất cả điểm (0 = user, 1-n = places)
-        coords = [user_location] + [(p["lat"], p["lon"]) for p in places]
+        coords = tuple(
+            [(user_location[0], user_location[1])] + [(p["lat"], p["lon"]) for p in places]
+        )
+        return _haversine_matrix(coords)
+
+    @staticmethod
+    def get_distance_info(
+        user_location: Tuple[float, float],
+        places: List[Dict[str, Any]]
+    ) -> Tuple[np.ndarray, float, float]:
+        """
+        Lấy distance matrix kèm max_distance và max_radius (có cache LRU)
         
-        # Tính khoảng cách giữa mọi cặp điểm bằng Haversine (NHANH)
-        for i in range(n + 1):
-            for j in range(i + 1, n + 1):  # Chỉ tính nửa trên, copy sang nửa dưới
-                dist = self.calculate_distance_haversine(
-                    coords[i][0], coords[i][1],
-                    coords[j][0], coords[j][1]
-                )
-                matrix[i][j] = dist
-                matrix[j][i] = dist  # Ma trận đối xứng
+        Các request liên tiếp với cùng user_location và cùng danh sách places
+        dùng lại kết quả đã tính. Ma trận trả về được dùng chung giữa các lần
+        gọi → caller KHÔNG được sửa trực tiếp.
         
-        return matrix
\ No newline at end of file
+        Args:
+            user_location: (lat, lon) của user
+            places: Danh sách địa điểm
+            
+        Returns:
+            (distance_matrix (n+1, n+1) read-only, max_distance, max_radius)
+        """
+        coords = tuple(
+            [(float(user_location[0]), float(user_location[1]))] +
+            [(float(p["lat"]), float(p["lon"])) for p in places]
+        )
+        return _cached_distance_info(coords)
\ No newline at end of file
@@ -0,0 +1,212 @@
+"""
+Numeric Kernels
+Các kernel số học (Numba JIT) cho vòng lặp chọn POI của route builder
+
+Kernel nhận dữ liệu dạng mảng NumPy (không dict, không attribute lookup) và
+trả về combined score cho toàn bộ candidates trong 1 lần gọi. Nếu môi trường
+không cài numba, các hàm vẫn chạy như Python thuần (cùng kết quả, chậm hơn).
+"""
+import math
+import numpy as np
+
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+    def njit(*args, **kwargs):
+        """Fallback khi không có numba: trả về hàm gốc, không compile"""
+        if len(args) == 1 and callable(args[0]) and not kwargs:
+            return args[0]
+
+        def decorator(func):
+            return func
+        return decorator
+
+
+# Hằng số đổi đơn vị góc (giống math.radians / math.degrees của CPython)
+DEG_TO_RAD = math.pi / 180.0
+RAD_TO_DEG = 180.0 / math.pi
+
+
+@njit(cache=True)
+def score_middle_candidates(
+    dist_row,
+    dist_to_user,
+    similarities,
+    ratings,
+    stay_times,
+    sin_lats,
+    cos_lats,
+    lons,
+    visited,
+    cur_lat,
+    cur_lon,
+    prev_bearing,
+    max_distance,
+    min_per_km,
+    max_travel_minutes,
+    total_travel_time,
+    total_stay_time,
+    max_time_minutes,
+    weight_rows
+):
+    """
+    Tính combined score cho tất cả POI giữa tại 1 bước greedy
+
+    Mỗi candidate bị loại (score = -inf) nếu:
+    - Đã visited
+    - Travel time từ vị trí hiện tại > max_travel_minutes
+    - (travel đến POI) + (stay tại POI) + (quay về user) vượt time budget
+
+    Công thức score giống Calculator.score_middle:
+    distance + similarity + rating + bearing. Weights (high/low similarity) đã được
+    chọn sẵn cho từng POI trong weight_rows → không rẽ nhánh trong vòng lặp.
+
+    Args:
+        dist_row: Khoảng cách từ vị trí hiện tại đến từng POI (km)
+        dist_to_user: Khoảng cách từ từng POI về user (km)
+        similarities, ratings, stay_times: Thuộc tính từng POI
+        sin_lats, cos_lats: sin/cos vĩ độ từng POI (lat_trig_tables, tính 1 lần mỗi request)
+        lons: Kinh độ từng POI
+        visited: Mask các POI đã dùng
+        cur_lat, cur_lon: Tọa độ vị trí hiện tại
+        prev_bearing: Hướng di chuyển trước đó (độ)
+        max_distance: Khoảng cách lớn nhất (để normalize)
+        min_per_km: Số phút di chuyển cho 1 km (theo phương tiện)
+        max_travel_minutes: Ngưỡng travel time cho 1 chặng (inf = không giới hạn)
+        total_travel_time, total_stay_time: Thời gian đã dùng (phút)
+        max_time_minutes: Time budget tối đa (phút)
+        weight_rows: Mảng (n, 4) weights [distance, similarity, rating, bearing] của từng POI
+
+    Returns:
+        Mảng combined score (-inf = không khả thi)
+    """
+    n = dist_row.shape[0]
+    out = np.full(n, -np.inf)
+
+    lat1_rad = cur_lat * DEG_TO_RAD
+    sin_lat1 = math.sin(lat1_rad)
+    cos_lat1 = math.cos(lat1_rad)
+
+    for i in range(n):
+        if visited[i]:
+            continue
+
+        travel_time = dist_row[i] * min_per_km
+        if travel_time > max_travel_minutes:
+            continue
+
+        return_time = dist_to_user[i] * min_per_km
+        temp_travel = total_travel_time + travel_time
+        temp_stay = total_stay_time + stay_times[i]
+        if temp_travel + temp_stay + return_time > max_time_minutes:
+            continue
+
+        normalized_distance = dist_row[i] / max_distance if max_distance > 0 else 0.0
+        distance_score = 1.0 - normalized_distance
+
+        # Bearing từ vị trí hiện tại đến POI i
+        delta_lon = (lons[i] - cur_lon) * DEG_TO_RAD
+        x = math.sin(delta_lon) * cos_lats[i]
+        y = cos_lat1 * sin_lats[i] - sin_lat1 * cos_lats[i] * math.cos(delta_lon)
+        bearing = (math.atan2(x, y) * RAD_TO_DEG + 360) % 360
+
+        bearing_diff = abs(prev_bearing - bearing)
+        if bearing_diff > 180:
+            bearing_diff = 360 - bearing_diff
+        bearing_score = 1.0 - (bearing_diff / 180.0)
+
+        w = weight_rows[i]
+        out[i] = (
+            w[0] * distance_score +
+            w[1] * similarities[i] +
+            w[2] * ratings[i] +
+            w[3] * bearing_score
+        )
+
+    return out
+
+
+@njit(cache=True)
+def score_linear_candidates(
+    distances,
+    similarities,
+    ratings,
+    feasible,
+    max_distance,
+    w_distance,
+    w_similarity,
+    w_rating
+):
+    """
+    Combined score dạng tuyến tính (distance + similarity + rating) cho POI đầu / POI cuối
+
+    Gộp normalize distance, tổng có trọng số và mask khả thi vào 1 vòng lặp
+    (thay cho 3-4 phép NumPy tạo mảng trung gian). Công thức giống
+    Calculator.score_first / score_last.
+
+    Args:
+        distances: Khoảng cách dùng để tính distance score (km)
+        similarities, ratings: Thuộc tính từng POI
+        feasible: Mask POI khả thi (False → -inf)
+        max_distance: Khoảng cách lớn nhất (để normalize)
+        w_distance, w_similarity, w_rating: Weights
+
+    Returns:
+        Mảng combined score (-inf = không khả thi)
+    """
+    n = distances.shape[0]
+    out = np.full(n, -np.inf)
+    for i in range(n):
+        if not feasible[i]:
+            continue
+        normalized_distance = distances[i] / max_distance if max_distance > 0 else 0.0
+        distance_score = 1.0 - normalized_distance
+        out[i] = (
+            w_distance * distance_score +
+            w_similarity * similarities[i] +
+            w_rating * ratings[i]
+        )
+    return out
+
+
+@njit(cache=True)
+def lat_trig_tables(lats):
+    """
+    Bảng sin/cos vĩ độ (radian) của từng POI
+
+    Dùng math.sin/math.cos từng phần tử (không dùng np.sin) để kết quả trùng từng bit
+    với phép tính trực tiếp trong score_middle_candidates trước đây.
+
+    Args:
+        lats: Vĩ độ từng POI (độ)
+
+    Returns:
+        (sin_lats, cos_lats)
+    """
+    n = lats.shape[0]
+    sin_lats = np.empty(n)
+    cos_lats = np.empty(n)
+    for i in range(n):
+        lat_rad = lats[i] * DEG_TO_RAD
+        sin_lats[i] = math.sin(lat_rad)
+        cos_lats[i] = math.cos(lat_rad)
+    return sin_lats, cos_lats
+
+
+def warmup() -> None:
+    """Compile trước các kernel (gọi 1 lần lúc import) để request đầu không chịu chi phí JIT"""
+    one = np.ones(1)
+    lat_trig_tables(one)
+    score_linear_candidates(one, one, one, np.ones(1, dtype=np.bool_), 1.0, 0.25, 0.25, 0.5)
+    score_middle_candidates(
+        one, one, one, one, one, one, one, one, np.zeros(1, dtype=np.bool_),
+        0.0, 0.0, 0.0, 1.0, 2.0, np.inf, 0.0, 0.0, 180.0,
+        np.full((1, 4), 0.25)
+    )
+
+
+if NUMBA_AVAILABLE:
+    warmup()
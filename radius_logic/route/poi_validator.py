@@ -2,23 +2,35 @@
 POI Validator
 Logic kiểm tra và validate POI
 """
-from typing import Dict, Any
+from typing import List, Dict, Any, Tuple, Optional
+import numpy as np
 from datetime import datetime
 from utils.time_utils import TimeUtils
 from .route_config import RouteConfig
 
 class POIValidator:
 
-    def get_stay_time(self, place: Dict[str, Any]) -> float:
+    __slots__ = ()
+
+    @staticmethod
+    def get_stay_time(place: Dict[str, Any]) -> float:
         stay = place.get("stay_time")
+        if stay is None:
+            return RouteConfig.DEFAULT_STAY_TIME
+        # Fast path cho kiểu số thường gặp (không cần try/except)
+        stay_type = type(stay)
+        if stay_type is float:
+            return stay
+        if stay_type is int:
+            return float(stay)
         try:
-            return float(stay) if stay is not None else RouteConfig.DEFAULT_STAY_TIME
+            return float(stay)
         except (TypeError, ValueError):
             return RouteConfig.DEFAULT_STAY_TIME
 
     
+    @staticmethod
     def is_poi_available_at_time(
-        self,
         place: Dict[str, Any],
         arrival_datetime: datetime
     ) -> bool:
@@ -35,13 +47,67 @@ class POIValidator:
         if not arrival_datetime:
             return True
         
-        stay_time = self.get_stay_time(place)
+        stay_time = POIValidator.get_stay_time(place)
         return TimeUtils.has_enough_time_to_stay(
             place.get('open_hours', []), 
             arrival_datetime, 
             stay_time
         )
     
+    @staticmethod
+    def is_poi_available_after(
+        place: Dict[str, Any],
+        start_datetime: datetime,
+        offset_minutes: float,
+        stay_minutes: Optional[float] = None
+    ) -> bool:
+        """
+        Giống is_poi_available_at_time với arrival = start_datetime + offset_minutes,
+        không tạo datetime trung gian (dùng trong vòng lặp chọn POI)
+        
+        Args:
+            place: POI cần kiểm tra
+            start_datetime: Thời điểm bắt đầu route
+            offset_minutes: Số phút từ start_datetime đến lúc tới POI
+            stay_minutes: Stay time gốc đã parse sẵn (PlaceArrays.stay_times), None = đọc từ place
+            
+        Returns:
+            True nếu POI mở cửa và có đủ thời gian stay
+        """
+        if not start_datetime:
+            return True
+        
+        return TimeUtils.has_enough_time_to_stay_after(
+            place.get('open_hours', []),
+            start_datetime,
+            offset_minutes,
+            POIValidator.get_stay_time(place) if stay_minutes is None else stay_minutes
+        )
+    
+    @staticmethod
+    def build_food_type_ids(places: List[Dict[str, Any]]) -> np.ndarray:
+        """
+        Mã hóa (poi_type_clean, main_subcategory, specialization) của từng POI thành int id
+        
+        2 POI có cùng id >= 0 ⇔ is_same_food_type(place1, place2) == True
+        → vòng chọn POI giữa chỉ cần so sánh 2 số nguyên.
+        
+        Args:
+            places: Danh sách POI
+            
+        Returns:
+            Mảng int32 theo index POI (-1 = không phải food category)
+        """
+        key_to_id: Dict[Tuple[Any, Any, Any], int] = {}
+        food_type_ids = np.full(len(places), -1, dtype=np.int32)
+        for i, place in enumerate(places):
+            poi_type = place.get("poi_type_clean", "")
+            if poi_type not in RouteConfig.FOOD_CATEGORIES:
+                continue
+            key = (poi_type, place.get("main_subcategory"), place.get("specialization"))
+            food_type_ids[i] = key_to_id.setdefault(key, len(key_to_id))
+        return food_type_ids
+    
     @staticmethod
     def is_same_food_type(place1: Dict[str, Any], place2: Dict[str, Any]) -> bool:
         """
@@ -0,0 +1,474 @@
+"""
+Route Builder Service
+Xây dựng lộ trình tối ưu từ danh sách địa điểm sử dụng thuật toán Greedy
+"""
+import logging
+import asyncio
+import operator
+import multiprocessing
+import functools
+import numpy as np
+from concurrent.futures import Executor, ProcessPoolExecutor
+from datetime import datetime, timedelta
+from typing import List, Dict, Any, Tuple, Optional
+from utils.time_utils import TimeUtils
+from .route_config import RouteConfig
+from .geographic_utils import GeographicUtils
+from .poi_validator import POIValidator
+from .calculator import Calculator
+from .route_builder_target import TargetRouteBuilder
+from .route_builder_duration import DurationRouteBuilder
+from .worker import build_routes_in_worker, init_worker, slim_places
+
+logger = logging.getLogger(__name__)
+
+# (travel_time_minutes, stay_time_minutes) của 1 POI trong route đã format
+_get_leg_times = operator.itemgetter("travel_time_minutes", "stay_time_minutes")
+
+class RouteBuilder:
+    """
+    Class xây dựng lộ trình tối ưu sử dụng thuật toán Greedy với weighted scoring
+    
+    Thuật toán:
+    1. Chọn điểm xuất phát có combined_score cao nhất từ vị trí user
+    2. Chọn các điểm tiếp theo có combined_score cao nhất từ vị trí hiện tại
+    3. Điểm cuối phải gần user (< 20% max_distance) và có điểm cao
+    
+    Combined score = 0.7 × normalized_score + 0.3 × (1 - normalized_distance)
+    """
+    
+    # Thời gian tham quan cố định cho tất cả địa điểm (phút)
+    DEFAULT_STAY_TIME = RouteConfig.DEFAULT_STAY_TIME
+    
+    __slots__ = ("geo", "validator", "calculator", "target_builder", "duration_builder")
+    
+    
+    def __init__(self):
+        """Khởi tạo RouteBuilder"""
+        self.geo = GeographicUtils()
+        self.validator = POIValidator()
+        self.calculator = Calculator(self.geo)
+        self.target_builder = TargetRouteBuilder(
+            geo=self.geo,
+            validator=self.validator,
+            calculator=self.calculator
+        )
+        self.duration_builder = DurationRouteBuilder(
+            geo=self.geo,
+            validator=self.validator,
+            calculator=self.calculator
+        )
+        
+      
+    @staticmethod
+    def create_executor(max_workers: Optional[int] = None) -> ProcessPoolExecutor:
+        """
+        Tạo process pool cho build_routes_async (tạo 1 lần lúc server startup, dùng lại cho mọi request)
+        
+        Worker được tạo bằng "spawn" (không fork): process server đang giữ thread của
+        model embedding và các connection (DB/Redis/Qdrant), fork từ đó không an toàn.
+        Mỗi worker chạy init_worker lúc khởi động: import NumPy/Numba kernels và tạo sẵn
+        RouteBuilder → task đầu tiên không phải chịu chi phí import / khởi tạo.
+        Caller chịu trách nhiệm shutdown() pool khi tắt server.
+        
+        Args:
+            max_workers: Số process (None = mặc định của ProcessPoolExecutor)
+            
+        Returns:
+            ProcessPoolExecutor đã gắn initializer
+        """
+        return ProcessPoolExecutor(
+            max_workers=max_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=init_worker
+        )
+    
+    def build_routes(
+        self,
+        user_location: Tuple[float, float],
+        places: List[Dict[str, Any]],
+        transportation_mode: str,
+        max_time_minutes: int,
+        target_places: int = 5,
+        max_routes: int = 3,
+        current_datetime: Optional[datetime] = None,
+        duration_mode: bool = False
+    ) -> List[Dict[str, Any]]:
+        """
+        Xây dựng nhiều lộ trình (top 3) bằng cách thử các điểm xuất phát khác nhau
+        
+        Args:
+            user_location: (lat, lon) của user
+            places: Danh sách địa điểm từ Qdrant (top 10)
+            transportation_mode: Phương tiện
+            max_time_minutes: Thời gian tối đa
+            target_places: Số địa điểm mỗi lộ trình
+            max_routes: Số lộ trình tối đa (mặc định 3)
+            current_datetime: Thời điểm bắt đầu route (để validate opening hours)
+            
+        Returns:
+            List các lộ trình tốt nhất (đã loại bỏ trùng lặp và validate thời gian mở cửa)
+        """
+        if not places:
+            return []
+        
+        if target_places > len(places):
+            target_places = len(places)
+        
+        # Xây dựng distance matrix 1 lần, dùng chung cho tất cả các lần build_route
+        # (cache theo user_location + tọa độ places → request lặp lại không tính lại)
+        distance_matrix, max_distance, max_radius = self.geo.get_distance_info(user_location, places)
+        # similarity + rating dạng mảng, dùng chung cho mọi lần tính combined score
+        place_arrays = self.calculator.build_place_arrays(places)
+        
+        # ================================================================
+        # Xây dựng route đầu tiên với fallback logic:
+        #   Vòng lặp ngoài: nếu cả 5 lần thử đều cho route < 3 POI
+        #                   → giảm stay_time 10 phút (qua stay_time_reduction)
+        #                     và thử lại từ đầu (tối đa giảm 60 phút)
+        #   Vòng lặp trong: thử tối đa 5 first_place_idx khác nhau
+        #                   được chọn bởi select_first_poi (đúng logic meal/cafe/opening)
+        #   Route hợp lệ: phải có >= 3 POI
+        # ================================================================
+        _MIN_POI        = 3
+        _MAX_ATTEMPTS   = 5
+        _REDUCTION_STEP = 10  # Giảm stay_time mỗi vòng (phút)
+        _MAX_REDUCTION  = 60  # Giảm tối đa 60 phút (6 vòng)
+
+        # Xây dựng danh sách 5 POI xuất phát hợp lệ THEO ĐÚNG LOGIC của select_first_poi:
+        # (meal-time filter, cafe-sequence exclusion, opening hours validation...)
+        # Cách làm: select_first_candidates lấy top 5 trong 1 lần (giống gọi select_first_poi
+        # 5 lần, mỗi lần loại trừ các index đã chọn trước)
+        # → khác với cách cũ [None, 0, 1, 2, 3] chỉ sort theo score thuần túy
+        _builder_ref = self.duration_builder if duration_mode else self.target_builder
+        _meal_info = _builder_ref.analyze_meal_requirements(
+            places, current_datetime, max_time_minutes
+        )
+        # Opening hours của POI đầu chỉ phụ thuộc (POI, current_datetime) → cache cho mọi
+        # lần chọn POI đầu trong request này
+        _first_available: Dict[int, bool] = {}
+        _first_idx_list = _builder_ref.select_first_candidates(
+            places=places,
+            distance_matrix=distance_matrix,
+            max_distance=max_distance,
+            transportation_mode=transportation_mode,
+            current_datetime=current_datetime,
+            should_insert_restaurant_for_meal=_meal_info["should_insert_restaurant_for_meal"],
+            meal_windows=_meal_info["meal_windows"],
+            should_insert_cafe=_meal_info.get("should_insert_cafe", False),
+            limit=_MAX_ATTEMPTS,
+            place_arrays=place_arrays,
+            availability_cache=_first_available,
+            category_masks=_meal_info.get("category_masks")
+        )
+
+        if not _first_idx_list:
+            return []
+
+        logger.debug("📋 Danh sách %d POI xuất phát (theo logic select_first_poi): %s", len(_first_idx_list), _first_idx_list)
+
+        # Bind sẵn builder + tham số chung 1 lần cho mọi lần build route (chỉ khác first_place_idx)
+        _build_kwargs = dict(
+            user_location=user_location,
+            places=places,
+            transportation_mode=transportation_mode,
+            max_time_minutes=max_time_minutes,
+            current_datetime=current_datetime,
+            distance_matrix=distance_matrix,
+            max_distance=max_distance,
+            max_radius=max_radius,
+            meal_info=_meal_info,
+            place_arrays=place_arrays
+        )
+        if not duration_mode:
+            _build_kwargs["target_places"] = target_places
+        _build_route = functools.partial(_builder_ref.build_route, **_build_kwargs)
+
+        route_1        = None
+        _stay_reduction = 0.0
+
+        while _stay_reduction <= _MAX_REDUCTION:
+            # Thông báo khi đang chạy fallback (bỏ qua lần đầu stay_reduction=0)
+            self.calculator.stay_time_reduction = _stay_reduction
+            if _stay_reduction > 0:
+                logger.debug(
+                    "\n🔄 FALLBACK: Giảm stay_time %.0f phút, thử lại tối đa %d route...",
+                    _stay_reduction, _MAX_ATTEMPTS
+                )
+
+            # Build lần lượt theo thứ tự ưu tiên, dừng ở route hợp lệ đầu tiên
+            # (thường là lần thử đầu) → các POI xuất phát sau không phải build
+            for _attempt, _first_idx in enumerate(_first_idx_list):
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(
+                        "  → Lần thử %d/%d: first_place_idx=%d, stay_reduction=%.0f phút",
+                        _attempt + 1, _MAX_ATTEMPTS, _first_idx, _stay_reduction
+                    )
+                _candidate = _build_route(first_place_idx=_first_idx)
+                if _candidate is not None and len(_candidate.get("places", [])) >= _MIN_POI:
+                    route_1 = _candidate
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug(
+                            "  ✅ Route hợp lệ (%d POI) tìm được ở lần thử %d (stay_reduction=%.0f phút)",
+                            len(_candidate["places"]), _attempt + 1, _stay_reduction
+                        )
+                    break  # Thoát vòng lặp trong, giữ stay_time_reduction hiện tại
+
+            if route_1 is not None:
+                break  # Đã có route hợp lệ, thoát vòng lặp ngoài
+
+            _best_count = 0  # chỉ để in log
+            logger.debug(
+                "  ⚠️  Cả %d lần thử đều không đủ %d POI. Giảm stay_time thêm %d phút và thử lại...",
+                _MAX_ATTEMPTS, _MIN_POI, _REDUCTION_STEP
+            )
+            _stay_reduction += _REDUCTION_STEP
+
+        if route_1 is None:
+            logger.debug(
+                "  ❌ Không tìm được route >= %d POI dù đã giảm stay_time tới %.0f phút.",
+                _MIN_POI, _MAX_REDUCTION
+            )
+            self.calculator.stay_time_reduction = 0.0
+            return []
+
+        all_routes = [route_1]
+        # Dedupe theo tập POI (không quan tâm thứ tự): mỗi route là 1 bitmask (bit i = POI i),
+        # số POI khác nhau giữa 2 route = popcount(mask_a ^ mask_b)
+        all_route_masks = [self._route_mask(route_1["route"])]
+        
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("🎯 Route 1: %d POI, total_score=%.2f", len(route_1["route"]), route_1["total_score"])
+        
+        # ================================================================
+        # Xây dựng route 2, 3, ... với cùng logic select_first_poi
+        # - Giữ nguyên stay_time_reduction đã xác lập lúc build route_1
+        # - Mỗi route mới: gọi select_first_poi với exclude_indices = tất cả
+        #   first POI đã dùng ở các route trước → đúng filter meal/cafe/opening
+        # - Thử tối đa _MAX_ATTEMPTS candidates cho mỗi route; nếu candidate nào
+        #   trả về >= 3 POI và đủ khác biệt (>= 2 POI khác) thì chấp nhận
+        # ================================================================
+        if max_routes > 1:
+            # Tập hợp first POI đã dùng, bắt đầu từ route_1
+            _used_first_pois: set = {route_1["route"][0]}
+
+            while len(all_routes) < max_routes:
+                # Lấy tối đa _MAX_ATTEMPTS POI xuất phát mới (chưa dùng, đúng logic)
+                _candidates_n = _builder_ref.select_first_candidates(
+                    places=places,
+                    distance_matrix=distance_matrix,
+                    max_distance=max_distance,
+                    transportation_mode=transportation_mode,
+                    current_datetime=current_datetime,
+                    should_insert_restaurant_for_meal=_meal_info["should_insert_restaurant_for_meal"],
+                    meal_windows=_meal_info["meal_windows"],
+                    should_insert_cafe=_meal_info.get("should_insert_cafe", False),
+                    exclude_indices=_used_first_pois,
+                    limit=_MAX_ATTEMPTS,
+                    place_arrays=place_arrays,
+                    availability_cache=_first_available,
+                    category_masks=_meal_info.get("category_masks")
+                )
+
+                if not _candidates_n:
+                    break  # Không còn POI xuất phát hợp lệ nào
+
+                _found_next = False
+                for _first_idx_n in _candidates_n:
+                    route_result = _build_route(first_place_idx=_first_idx_n)
+                    if route_result is None or len(route_result.get("places", [])) < _MIN_POI:
+                        _used_first_pois.add(_first_idx_n)  # Đánh dấu đã thử, không dùng lại
+                        continue
+
+                    # Route trùng tập POI cho popcount = 0 → cũng bị loại ở đây
+                    route_mask = self._route_mask(route_result["route"])
+                    is_different_enough = all(
+                        (route_mask ^ m).bit_count() >= 2
+                        for m in all_route_masks
+                    )
+                    if not is_different_enough:
+                        _used_first_pois.add(_first_idx_n)
+                        continue
+
+                    all_route_masks.append(route_mask)
+                    all_routes.append(route_result)
+                    _used_first_pois.add(_first_idx_n)
+                    _found_next = True
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug(
+                            "🎯 Route %d: %d POI, total_score=%.2f, first_poi=%d",
+                            len(all_routes), len(route_result["route"]),
+                            route_result["total_score"], _first_idx_n
+                        )
+                    break  # Đã có route mới, chuyển vòng ngoài
+
+                if not _found_next:
+                    break  # Không tìm được route đủ điều kiện, dừng
+        
+        # Log tổng kết chỉ khi bật DEBUG (không chạy vòng lặp khi tắt log)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("\n📊 Kết quả: %d route(s)", len(all_routes))
+            for idx, route in enumerate(all_routes, 1):
+                logger.debug("   Route %d: %d POI, score=%.2f", idx, len(route["route"]), route["total_score"])
+        
+        # Format kết quả cuối cùng với route_id và order
+        result = []
+        # Opening hours chỉ phụ thuộc POI và ngày đến → 1 POI xuất hiện ở nhiều route chỉ tra 1 lần
+        opening_hours_cache: Dict[Tuple[Any, Any], Optional[Dict[str, Any]]] = {}
+        for idx, route in enumerate(all_routes, 1):
+            # Thêm route_id và order (số thứ tự di chuyển) vào mỗi place
+            route_places = route["places"]
+
+            # Không có current_datetime → không có metadata thời gian nào để bổ sung,
+            # bỏ qua toàn bộ vòng lặp arrival/opening hours
+            if not current_datetime:
+                result.append(self._route_summary(idx, route, list(route_places)))
+                continue
+
+            places_with_metadata = []
+
+            # Thời điểm đến từng POI (phút tính từ current_datetime):
+            # travel cộng dồn + stay của các POI trước đó
+            arrival_offsets = None
+            if route_places:
+                # format_route_result luôn ghi đủ 2 key này cho mỗi POI
+                travel_times, stay_times = zip(*map(_get_leg_times, route_places))
+                travel_arr = np.array(travel_times, dtype=np.float64)
+                stay_arr = np.array(stay_times, dtype=np.float64)
+                stay_arr[1:] = stay_arr[:-1]
+                stay_arr[0] = 0.0
+                arrival_offsets = np.cumsum(travel_arr + stay_arr).tolist()
+
+            for order, place in enumerate(route_places, 1):
+                # Dict POI do format_route_result tạo riêng cho route này (không phải
+                # dict gốc từ places) → bổ sung metadata trực tiếp, không cần copy
+                place_data = place
+
+                # Thêm opening hours info nếu có current_datetime
+                if arrival_offsets is not None:
+                    arrival_time = current_datetime + timedelta(minutes=arrival_offsets[order - 1])
+
+                    # Lấy opening hours cho ngày đó
+                    oh_key = (place_data["place_id"], arrival_time.date())
+                    if oh_key in opening_hours_cache:
+                        opening_hours_today = opening_hours_cache[oh_key]
+                    else:
+                        opening_hours_today = TimeUtils.get_opening_hours_for_day(
+                            place_data.get("open_hours", []),
+                            arrival_time
+                        )
+                        opening_hours_cache[oh_key] = opening_hours_today
+
+                    # Thêm vào response
+                    place_data["arrival_time"] = arrival_time.strftime('%Y-%m-%d %H:%M:%S')
+                    place_data["opening_hours_today"] = opening_hours_today
+                    place_data["order"] = order  # Số thứ tự di chuyển (1, 2, 3, ...)
+
+                places_with_metadata.append(place_data)
+            
+            result.append(self._route_summary(idx, route, places_with_metadata))
+        
+        self.calculator.stay_time_reduction = 0.0  # Reset sau khi hoàn thành build_routes
+        return result
+    
+    @staticmethod
+    def _route_summary(
+        route_id: int,
+        route: Dict[str, Any],
+        places: List[Dict[str, Any]]
+    ) -> Dict[str, Any]:
+        """
+        Tạo dict route trả về cho API
+
+        Args:
+            route_id: Số thứ tự route (bắt đầu từ 1)
+            route: Route đã format (format_route_result)
+            places: Danh sách POI (đã bổ sung metadata nếu có)
+
+        Returns:
+            Dict route cho response
+        """
+        return {
+            "route_id": route_id,
+            "total_time_minutes": route["total_time_minutes"],
+            "travel_time_minutes": route["travel_time_minutes"],
+            "stay_time_minutes": route["stay_time_minutes"],
+            "total_score": route["total_score"],
+            "avg_score": route["avg_score"],
+            "efficiency": route["efficiency"],
+            "places": places
+        }
+
+    @staticmethod
+    def _route_mask(route: List[int]) -> int:
+        """
+        Bitmask tập POI của route (bit i bật = POI index i có trong route, không phụ thuộc thứ tự)
+
+        Args:
+            route: Danh sách index POI của route
+
+        Returns:
+            Bitmask (int Python, không giới hạn số POI)
+        """
+        mask = 0
+        for idx in route:
+            mask |= 1 << idx
+        return mask
+
+    async def build_routes_async(
+        self,
+        user_location: Tuple[float, float],
+        places: List[Dict[str, Any]],
+        transportation_mode: str,
+        max_time_minutes: int,
+        target_places: int = 5,
+        max_routes: int = 3,
+        current_datetime: Optional[datetime] = None,
+        duration_mode: bool = False,
+        executor: Optional[Executor] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Async wrapper: offload build_routes sang executor để không block event loop
+        
+        Args:
+            user_location: Tọa độ user (lat, lon)
+            places: Danh sách địa điểm
+            transportation_mode: Phương tiện di chuyển
+            max_time_minutes: Thời gian tối đa (phút)
+            target_places: Số lượng địa điểm trong mỗi route
+            max_routes: Số lượng routes tối đa
+            current_datetime: Thời điểm hiện tại của user
+            executor: Executor chạy build_routes (None = default threadpool của event loop)
+            
+        Returns:
+            List các routes tối ưu
+            
+        Note:
+            - Nếu không truyền executor, dùng default threadpool của event loop
+              (cùng process → dùng chung cache distance/places matrix giữa các request)
+            - Production có thể tạo ProcessPoolExecutor 1 lần bằng RouteBuilder.create_executor()
+              (worker spawn + khởi tạo sẵn) và truyền vào đây cho CPU-intensive greedy algorithm
+            - Với process pool, chỉ tham số được pickle sang process con (places đã bỏ các field
+              không dùng - xem ROUTE_PLACE_FIELDS, datetime, ...);
+              RouteBuilder không pickle được nên process con tự tạo builder riêng (route/worker.py)
+        """
+        loop = asyncio.get_running_loop()
+        
+        kwargs = dict(
+            user_location=user_location,
+            places=places,
+            transportation_mode=transportation_mode,
+            max_time_minutes=max_time_minutes,
+            target_places=target_places,
+            max_routes=max_routes,
+            current_datetime=current_datetime,
+            duration_mode=duration_mode
+        )
+        if isinstance(executor, ProcessPoolExecutor):
+            # Chỉ pickle các field route builder cần, không gửi nguyên payload của places
+            kwargs["places"] = slim_places(places)
+            func = functools.partial(build_routes_in_worker, **kwargs)
+        else:
+            func = functools.partial(self.build_routes, **kwargs)
+        
+        return await loop.run_in_executor(executor, func)
@@ -6,6 +6,7 @@ Module này định nghĩa lớp BaseRouteBuilder - một lớp cơ sở chứa
 
 Các chức năng chính:
 - analyze_meal_requirements: Phân tích yêu cầu chèn Restaurant cho meal time
+- build_category_codes: Mã hóa category thành int id + bảng xen kẽ category
 - select_first_poi: Chọn POI đầu tiên dựa trên combined score
 - check_first_poi_meal_status: Kiểm tra POI đầu có phải Restaurant trong meal window không
 - select_last_poi: Chọn POI cuối cùng gần user location
@@ -14,13 +15,41 @@ Các chức năng chính:
 Author: Kyanon Team
 Created: 2026-01
 """
+import logging
 from datetime import datetime, timedelta
-from typing import List, Dict, Any, Tuple, Optional
+from typing import List, Dict, Any, Tuple, Optional, Iterator
+import numpy as np
 from utils.time_utils import TimeUtils
 from .route_config import RouteConfig
 from .geographic_utils import GeographicUtils
 from .poi_validator import POIValidator
-from .calculator import Calculator
+from .calculator import Calculator, PlaceArrays
+from .kernels import score_middle_candidates, score_linear_candidates
+
+logger = logging.getLogger(__name__)
+
+
+def _weights_vector(weights: Dict[str, float]) -> np.ndarray:
+    """Chuyển dict weights thành vector [distance, similarity, rating, bearing]"""
+    return np.array([
+        weights["distance"],
+        weights["similarity"],
+        weights["rating"],
+        weights.get("bearing", 0.0)
+    ], dtype=np.float64)
+
+
+# Bảng weights POI giữa: hàng 0 = similarity >= threshold, hàng 1 = similarity < threshold
+MIDDLE_WEIGHTS_TABLE = np.stack([
+    _weights_vector(RouteConfig.MIDDLE_POI_WEIGHTS_HIGH_SIMILARITY),
+    _weights_vector(RouteConfig.MIDDLE_POI_WEIGHTS_LOW_SIMILARITY)
+])
+
+# Giới hạn travel time cho 1 chặng khi đi bộ (phút)
+WALKING_MAX_TRAVEL_MINUTES = 15
+
+# Số candidate tốt nhất được xếp hạng trước (partial select); thường chỉ cần vài candidate đầu
+RANKED_CANDIDATES_HEAD = 8
 
 class BaseRouteBuilder:
     """
@@ -39,6 +68,8 @@ class BaseRouteBuilder:
         calculator (Calculator): Calculator cho travel time và combined score
     """
     
+    __slots__ = ("geo", "validator", "calculator")
+    
     def __init__(
         self,
         geo: GeographicUtils,
@@ -71,6 +102,10 @@ class BaseRouteBuilder:
         Returns:
             Dict chứa:
             - all_categories (List[str]): List các category unique, giữ thứ tự xuất hiện
+            - category_ids (np.ndarray): int32 id category của từng POI (-1 = không có)
+            - category_masks (Tuple[np.ndarray, np.ndarray]): bool mask (is_restaurant, is_cafe)
+              của từng POI, dùng chung cho select_first_poi / select_last_poi
+            - food_type_ids (np.ndarray): id food type của từng POI (POIValidator.build_food_type_ids)
             - should_insert_restaurant_for_meal (bool): True nếu cần ưu tiên Restaurant cho meal
             - meal_windows (Dict): {"lunch": (start, end), "dinner": (start, end)} nếu có overlap
             - need_lunch_restaurant (bool): True nếu overlap lunch >= 60 phút
@@ -84,6 +119,16 @@ class BaseRouteBuilder:
         all_categories = list(dict.fromkeys(
             place.get('category') for place in places if 'category' in place
         ))
+        category_to_id = {cat: idx for idx, cat in enumerate(all_categories)}
+        category_ids = np.array(
+            [category_to_id.get(place.get('category'), -1) for place in places],
+            dtype=np.int32
+        )
+        # "Cafe" chỉ là "Cafe" (không bao gồm "Cafe & Bakery"); id -2 = không có category này
+        category_masks = (
+            category_ids == category_to_id.get("Restaurant", -2),
+            category_ids == category_to_id.get("Cafe", -2)
+        )
         has_cafe = "Cafe & Bakery" in all_categories
         has_restaurant = "Restaurant" in all_categories
         # Kiểm tra có "Cafe" (không phải "Cafe & Bakery") để kích hoạt cafe-sequence
@@ -119,6 +164,9 @@ class BaseRouteBuilder:
         
         return {
             "all_categories": all_categories,
+            "category_ids": category_ids,
+            "category_masks": category_masks,
+            "food_type_ids": self.validator.build_food_type_ids(places),
             "should_insert_restaurant_for_meal": should_insert_restaurant_for_meal,
             "meal_windows": meal_windows,
             "need_lunch_restaurant": need_lunch_restaurant,
@@ -126,18 +174,81 @@ class BaseRouteBuilder:
             "should_insert_cafe": should_insert_cafe
         }
     
+    def build_category_codes(
+        self,
+        places: List[Dict[str, Any]],
+        all_categories: List[str],
+        should_insert_cafe: bool,
+        category_ids: Optional[np.ndarray] = None,
+        food_type_ids: Optional[np.ndarray] = None
+    ) -> Dict[str, Any]:
+        """
+        Mã hóa category thành int id để vòng chọn POI giữa không phải so sánh string
+        
+        Gọi 1 lần mỗi route (sau khi should_insert_cafe đã chốt), thay cho việc
+        build alternation_categories + list.index() ở mỗi bước greedy.
+        
+        Args:
+            places: Danh sách POI candidates
+            all_categories: List category unique (thứ tự = thứ tự xen kẽ)
+            should_insert_cafe: True thì "Cafe" bị loại khỏi alternation
+            category_ids: id category từng POI (None = tự tính từ places)
+            food_type_ids: id food type từng POI (None = tự tính từ places)
+            
+        Returns:
+            Dict chứa:
+            - category_ids (np.ndarray): int32 id category của từng POI (-1 = không có)
+            - category_to_id (Dict[str, int]): category → id
+            - alternation_categories (List[str]): Các category tham gia xen kẽ
+            - next_category_id (np.ndarray): next_category_id[id] = id category xen kẽ
+              kế tiếp; phần tử cuối (index -1) dành cho category không có trong
+              alternation → quay về category xen kẽ đầu tiên
+            - food_type_ids (np.ndarray): id food type của từng POI (-1 = không phải food)
+        """
+        category_to_id = {cat: idx for idx, cat in enumerate(all_categories)}
+        if category_ids is None:
+            category_ids = np.array(
+                [category_to_id.get(place.get('category'), -1) for place in places],
+                dtype=np.int32
+            )
+        
+        # Loại "Cafe" khỏi alternation khi cafe-sequence bật
+        alternation_ids = [
+            idx for idx, cat in enumerate(all_categories)
+            if not (should_insert_cafe and cat == "Cafe")
+        ]
+        next_category_id = np.full(len(all_categories) + 1, -1, dtype=np.int32)
+        if alternation_ids:
+            next_category_id[:] = alternation_ids[0]
+            for pos, idx in enumerate(alternation_ids):
+                next_category_id[idx] = alternation_ids[(pos + 1) % len(alternation_ids)]
+        
+        return {
+            "category_ids": category_ids,
+            "category_to_id": category_to_id,
+            "alternation_categories": [all_categories[idx] for idx in alternation_ids],
+            "next_category_id": next_category_id,
+            "food_type_ids": (
+                food_type_ids if food_type_ids is not None
+                else self.validator.build_food_type_ids(places)
+            )
+        }
+    
     def select_first_poi(
         self,
         places: List[Dict[str, Any]],
         first_place_idx: Optional[int],
-        distance_matrix: List[List[float]],
+        distance_matrix: np.ndarray,
         max_distance: float,
         transportation_mode: str,
         current_datetime: Optional[datetime],
         should_insert_restaurant_for_meal: bool,
         meal_windows: Optional[Dict] = None,
         should_insert_cafe: bool = False,
-        exclude_indices: Optional[set] = None  # Tập các index POI cần bỏ qua (dùng cho fallback)
+        exclude_indices: Optional[set] = None,  # Tập các index POI cần bỏ qua (dùng cho fallback)
+        place_arrays: Optional[PlaceArrays] = None,
+        availability_cache: Optional[Dict[int, bool]] = None,
+        category_masks: Optional[Tuple[np.ndarray, np.ndarray]] = None
     ) -> Tuple[Optional[int], bool]:
         """
         Chọn POI đầu tiên cho route dựa trên combined score (score + distance)
@@ -162,6 +273,12 @@ class BaseRouteBuilder:
             current_datetime: Thời điểm bắt đầu (None = không validate opening hours)
             should_insert_restaurant_for_meal: True = có meal requirement
             meal_windows: Dict chứa lunch/dinner windows
+            place_arrays: PlaceArrays precompute từ Calculator.build_place_arrays
+            availability_cache: Dict index → POI có mở cửa lúc đến từ user không.
+                Dùng chung giữa các lần gọi trong 1 build_routes (cùng current_datetime)
+                để không tính lại arrival_time + opening hours cho cùng 1 POI
+            category_masks: (is_restaurant, is_cafe) từ analyze_meal_requirements
+                (None = tự tính từ places)
             
         Returns:
             Index của POI đầu tiên (0-based trong places list) hoặc None nếu không tìm thấy
@@ -173,6 +290,47 @@ class BaseRouteBuilder:
         if first_place_idx is not None:
             return first_place_idx, should_insert_cafe
         
+        candidates = self.select_first_candidates(
+            places, distance_matrix, max_distance, transportation_mode, current_datetime,
+            should_insert_restaurant_for_meal, meal_windows, should_insert_cafe,
+            exclude_indices=exclude_indices, limit=1, place_arrays=place_arrays,
+            availability_cache=availability_cache, category_masks=category_masks
+        )
+        return (candidates[0] if candidates else None), should_insert_cafe
+    
+    def select_first_candidates(
+        self,
+        places: List[Dict[str, Any]],
+        distance_matrix: np.ndarray,
+        max_distance: float,
+        transportation_mode: str,
+        current_datetime: Optional[datetime],
+        should_insert_restaurant_for_meal: bool,
+        meal_windows: Optional[Dict] = None,
+        should_insert_cafe: bool = False,
+        exclude_indices: Optional[set] = None,
+        limit: int = 1,
+        place_arrays: Optional[PlaceArrays] = None,
+        availability_cache: Optional[Dict[int, bool]] = None,
+        category_masks: Optional[Tuple[np.ndarray, np.ndarray]] = None
+    ) -> List[int]:
+        """
+        Top `limit` POI đầu hợp lệ theo đúng logic select_first_poi, tính trong 1 lần
+        
+        Kết quả giống gọi select_first_poi `limit` lần, mỗi lần thêm POI vừa chọn vào
+        exclude_indices, nhưng chỉ tính score / filter 1 lần.
+        
+        Args:
+            (giống select_first_poi)
+            limit: Số POI đầu tối đa cần lấy
+            
+        Returns:
+            List index POI theo thứ tự ưu tiên (có thể ít hơn limit)
+        """
+        selected: List[int] = []
+        if limit <= 0:
+            return selected
+        
         # Kiểm tra xem current_datetime có rơi vào meal window không
         is_in_meal_time = False
         if should_insert_restaurant_for_meal and current_datetime and meal_windows:
@@ -181,77 +339,78 @@ class BaseRouteBuilder:
                 lunch_start, lunch_end = meal_windows['lunch']
                 if lunch_start <= current_datetime <= lunch_end:
                     is_in_meal_time = True
-                    print(f"🍽️  Current time {current_datetime.strftime('%H:%M')} ĐÃ TRONG LUNCH TIME → BẮT BUỘC chọn Restaurant đầu")
+                    logger.debug("🍽️  Current time %s ĐÃ TRONG LUNCH TIME → BẮT BUỘC chọn Restaurant đầu", current_datetime.strftime('%H:%M'))
             
             if not is_in_meal_time and meal_windows.get('dinner'):
                 dinner_start, dinner_end = meal_windows['dinner']
                 if dinner_start <= current_datetime <= dinner_end:
                     is_in_meal_time = True
-                    print(f"🍽️  Current time {current_datetime.strftime('%H:%M')} ĐÃ TRONG DINNER TIME → BẮT BUỘC chọn Restaurant đầu")
+                    logger.debug("🍽️  Current time %s ĐÃ TRONG DINNER TIME → BẮT BUỘC chọn Restaurant đầu", current_datetime.strftime('%H:%M'))
+        
+        n = len(places)
+        min_per_km = self.calculator.get_minutes_per_km(transportation_mode)
+        if place_arrays is None:
+            place_arrays = self.calculator.build_place_arrays(places)
+        dist_from_user = distance_matrix[0, 1:]
         
-        best_first = None
-        best_first_score = -1
+        # Các filter không phụ thuộc opening hours → bool mask
+        feasible = np.ones(n, dtype=bool)
+        if category_masks is None:
+            category_masks = (
+                np.fromiter((p.get('category') == "Restaurant" for p in places), dtype=bool, count=n),
+                np.fromiter((p.get('category') == "Cafe" for p in places), dtype=bool, count=n)
+            )
+        is_restaurant, is_cafe = category_masks
         
-        def is_cafe_cat(cat: Optional[str]) -> bool:
-            # CHỈ "Cafe" (không bao gồm "Cafe & Bakery") mới trigger cafe-sequence
-            # "Cafe & Bakery" thuộc Food & Local Flavours → xen kẽ bình thường
-            return cat == "Cafe"
+        # Bỏ qua các POI đã được chọn ở lần thử trước (dùng khi build 5 candidates)
+        if exclude_indices:
+            feasible[list(exclude_indices)] = False
         
-        def is_restaurant_cat(cat: Optional[str]) -> bool:
-            # Category cố định từ UI: "Restaurant"
-            return cat == "Restaurant"
+        travel_times = dist_from_user * min_per_km
+        # validate for travel_time > 15 phút khi đi bộ
+        if current_datetime and transportation_mode == "WALKING":
+            feasible &= travel_times <= 15
         
-        for i, place in enumerate(places):
-            # Bỏ qua các POI đã được chọn ở lần thử trước (dùng khi build 5 candidates)
-            if exclude_indices and i in exclude_indices:
-                continue
-
+        # ĐÓNG poi trong category cafe khi cafe-sequence bật: cafe chỉ chèn sau 2 POI, không được là POI đầu
+        # CHỈ "Cafe" (không bao gồm "Cafe & Bakery") mới trigger cafe-sequence
+        if should_insert_cafe:
+            feasible &= ~is_cafe
+        
+        # Logic meal time cho POI đầu
+        if should_insert_restaurant_for_meal:
+            if is_in_meal_time:
+                # Đã TRONG meal time → BẮT BUỘC chọn Restaurant
+                feasible &= is_restaurant
+            else:
+                # CHƯA TỚI meal time → LOẠI Restaurant ra (giữ cho meal time sau)
+                feasible &= ~is_restaurant
+        
+        # Combined score POI đầu (giống Calculator.score_first) + mask trong 1 lần gọi kernel
+        weights = RouteConfig.FIRST_POI_WEIGHTS
+        combined = score_linear_candidates(
+            dist_from_user, place_arrays.scores, place_arrays.ratings, feasible,
+            float(max_distance), weights["distance"], weights["similarity"], weights["rating"]
+        )
+        
+        # Duyệt theo combined score giảm dần, các POI mở cửa đầu tiên là các POI tốt nhất
+        # (bằng điểm → index nhỏ hơn, giống cách chọn cũ)
+        for i in self.iter_ranked_candidates(combined):
             if current_datetime:
-                travel_time = self.calculator.calculate_travel_time(
-                    distance_matrix[0][i + 1],
-                    transportation_mode
-                )
-                # validate for travl_time > 10
-                if travel_time > 15 and transportation_mode == "WALKING":  
-                    print(f"Travel time {travel_time} phút quá lớn → BỎ QUA {place.get('name')}")
-                    continue
-                arrival_time = TimeUtils.get_arrival_time(current_datetime, travel_time)
-                if not self.validator.is_poi_available_at_time(place, arrival_time):
+                is_available = availability_cache.get(i) if availability_cache is not None else None
+                if is_available is None:
+                    is_available = self.validator.is_poi_available_after(
+                        places[i], current_datetime, travel_times[i],
+                        float(place_arrays.stay_times[i])
+                    )
+                    if availability_cache is not None:
+                        availability_cache[i] = is_available
+                if not is_available:
                     continue
-            
-            # ĐÓNG poi trong category cafe khi cafe-sequence bật: cafe chỉ chèn sau 2 POI, không được là POI đầu
-            if should_insert_cafe and is_cafe_cat(place.get('category')):
-                continue
-            
-            # Logic meal time cho POI đầu
-            if should_insert_restaurant_for_meal:
-                is_restaurant = is_restaurant_cat(place.get('category'))
-                
-                if is_in_meal_time:
-                    # Đã TRONG meal time → BẮT BUỘC chọn Restaurant
-                    if not is_restaurant:
-                        continue  # Bỏ qua POI không phải Restaurant
-                else:
-                    # CHƯA TỚI meal time → LOẠI Restaurant ra
-                    if is_restaurant:
-                        continue  # Bỏ qua Restaurant (giữ cho meal time sau)
-            
-            combined = self.calculator.calculate_combined_score(
-                place_idx=i,
-                current_pos=0,
-                places=places,
-                distance_matrix=distance_matrix,
-                max_distance=max_distance,
-                is_first=True
-            )
-            
-            if combined > best_first_score or (
-                combined == best_first_score and (best_first is None or i < best_first)
-            ):
-                best_first_score = combined
-                best_first = i
+            selected.append(i)
+            if len(selected) >= limit:
+                break
         
-        return best_first, should_insert_cafe
+        return selected
     
     def check_first_poi_meal_status(
         self,
@@ -259,7 +418,7 @@ class BaseRouteBuilder:
         places: List[Dict[str, Any]],
         should_insert_restaurant_for_meal: bool,
         meal_windows: Optional[Dict],
-        distance_matrix: List[List[float]],
+        distance_matrix: np.ndarray,
         transportation_mode: str,
         current_datetime: Optional[datetime],
         should_insert_cafe: bool = False
@@ -281,10 +440,8 @@ class BaseRouteBuilder:
 
         # Nếu có meal requirement và POI đầu là Restaurant với time info -> check windows
         if should_insert_restaurant_for_meal and first_cat == "Restaurant" and current_datetime and meal_windows:
-            travel_time = self.calculator.calculate_travel_time(
-                distance_matrix[0][first_poi_idx + 1],
-                transportation_mode
-            )
+            min_per_km = self.calculator.get_minutes_per_km(transportation_mode)
+            travel_time = distance_matrix[0, first_poi_idx + 1] * min_per_km
             arrival_first = TimeUtils.get_arrival_time(current_datetime, travel_time)
 
             if meal_windows.get("lunch"):
@@ -312,12 +469,103 @@ class BaseRouteBuilder:
 
         return lunch_inserted, dinner_inserted, cafe_counter, should_insert_cafe
     
+    def score_middle_candidates(
+        self,
+        places: List[Dict[str, Any]],
+        visited: np.ndarray,
+        current_pos: int,
+        distance_matrix: np.ndarray,
+        max_distance: float,
+        transportation_mode: str,
+        max_time_minutes: int,
+        total_travel_time: float,
+        total_stay_time: float,
+        prev_bearing: float,
+        user_location: Tuple[float, float],
+        place_arrays: Optional[PlaceArrays] = None
+    ) -> np.ndarray:
+        """
+        Tính combined score cho tất cả POI giữa tại 1 bước greedy (1 lần gọi kernel)
+        
+        Các filter thuần số (visited, travel time khi đi bộ, time budget) được xử lý
+        trong kernel; các filter còn lại (category, food type, opening hours) do
+        _select_middle_poi kiểm tra theo thứ tự score giảm dần.
+        
+        Args:
+            places: Danh sách POI
+            visited: Bool mask các POI đã dùng (visited[i] = True)
+            current_pos: Vị trí hiện tại trong distance_matrix (0 = user)
+            distance_matrix: Ma trận khoảng cách
+            max_distance: Khoảng cách lớn nhất (để normalize)
+            transportation_mode: Phương tiện di chuyển
+            max_time_minutes: Time budget tối đa
+            total_travel_time: Tổng travel time hiện tại
+            total_stay_time: Tổng stay time hiện tại
+            prev_bearing: Hướng di chuyển trước đó
+            user_location: Tọa độ user (lat, lon)
+            place_arrays: PlaceArrays precompute (None = tính lại từ places)
+            
+        Returns:
+            Mảng combined score theo index POI (-inf = không khả thi)
+        """
+        if place_arrays is None:
+            place_arrays = self.calculator.build_place_arrays(places)
+        similarities, ratings = place_arrays.scores, place_arrays.ratings
+        stay_times = self.calculator.stay_time_array(place_arrays)
+        lats, lons = place_arrays.lats, place_arrays.lons
+        if current_pos == 0:
+            cur_lat, cur_lon = user_location
+        else:
+            cur_lat, cur_lon = lats[current_pos - 1], lons[current_pos - 1]
+        
+        min_per_km = self.calculator.get_minutes_per_km(transportation_mode)
+        max_travel = WALKING_MAX_TRAVEL_MINUTES if transportation_mode == "WALKING" else np.inf
+        
+        return score_middle_candidates(
+            distance_matrix[current_pos, 1:],
+            distance_matrix[0, 1:],
+            similarities, ratings, stay_times,
+            place_arrays.sin_lats, place_arrays.cos_lats, lons, visited,
+            float(cur_lat), float(cur_lon), float(prev_bearing),
+            float(max_distance), float(min_per_km), float(max_travel),
+            float(total_travel_time), float(total_stay_time), float(max_time_minutes),
+            MIDDLE_WEIGHTS_TABLE[(similarities < RouteConfig.SIMILARITY_THRESHOLD).astype(np.int8)]
+        )
+    
+    @staticmethod
+    def iter_ranked_candidates(scores: np.ndarray) -> Iterator[int]:
+        """
+        Duyệt index POI theo combined score giảm dần (bằng nhau → index nhỏ trước),
+        dừng khi gặp POI không khả thi (score = -inf)
+
+        Chỉ xếp hạng RANKED_CANDIDATES_HEAD POI tốt nhất trước (argpartition, gồm cả các POI
+        bằng điểm ở biên); phần còn lại chỉ được sort khi caller duyệt hết nhóm đầu.
+        Thứ tự trả về giống hệt argsort stable trên toàn bộ mảng.
+        """
+        feasible = np.flatnonzero(scores != -np.inf)
+        if feasible.size <= RANKED_CANDIDATES_HEAD:
+            for i in feasible[np.argsort(-scores[feasible], kind="stable")]:
+                yield int(i)
+            return
+
+        neg_scores = -scores[feasible]
+        kth = np.partition(neg_scores, RANKED_CANDIDATES_HEAD - 1)[RANKED_CANDIDATES_HEAD - 1]
+        in_head = neg_scores <= kth
+
+        head = feasible[in_head]
+        for i in head[np.argsort(neg_scores[in_head], kind="stable")]:
+            yield int(i)
+
+        tail = feasible[~in_head]
+        for i in tail[np.argsort(neg_scores[~in_head], kind="stable")]:
+            yield int(i)
+    
     def select_last_poi(
         self,
         places: List[Dict[str, Any]],
-        visited: set,
+        visited: np.ndarray,
         current_pos: int,
-        distance_matrix: List[List[float]],
+        distance_matrix: np.ndarray,
         max_radius: float,
         transportation_mode: str,
         max_distance: float,
@@ -328,7 +576,9 @@ class BaseRouteBuilder:
         should_insert_restaurant_for_meal: bool,
         meal_windows: Optional[Dict],
         lunch_restaurant_inserted: bool,
-        dinner_restaurant_inserted: bool
+        dinner_restaurant_inserted: bool,
+        place_arrays: Optional[PlaceArrays] = None,
+        is_restaurant: Optional[np.ndarray] = None
     ) -> Optional[int]:
         """
         Chọn POI cuối cùng gần user location để giảm thời gian về
@@ -341,7 +591,7 @@ class BaseRouteBuilder:
         
         Args:
             places: Danh sách POI
-            visited: Set các POI đã dùng
+            visited: Bool mask các POI đã dùng (visited[i] = True)
             current_pos: Vị trí hiện tại trong distance_matrix
             distance_matrix: Ma trận khoảng cách
             max_radius: Khoảng cách xa nhất từ user đến POI (để tính threshold)
@@ -355,6 +605,8 @@ class BaseRouteBuilder:
             meal_windows: Dict meal windows
             lunch_restaurant_inserted: True nếu đã insert lunch restaurant
             dinner_restaurant_inserted: True nếu đã insert dinner restaurant
+            place_arrays: PlaceArrays precompute (None = tính lại từ places)
+            is_restaurant: Bool mask POI là Restaurant (None = so sánh category từng POI)
             
         Returns:
             Index của POI cuối (0-based) hoặc None nếu không tìm thấy
@@ -363,144 +615,130 @@ class BaseRouteBuilder:
             - POI cuối ưu tiên gần user để giảm return_time
             - Nếu POI cuối là Restaurant và arrival rơi vào meal window đã insert → Bỏ qua
         """
-        best_last = None
-        best_last_score = -1
-        
         radius_thresholds = RouteConfig.LAST_POI_RADIUS_THRESHOLDS
+        min_per_km = self.calculator.get_minutes_per_km(transportation_mode)
+        if place_arrays is None:
+            place_arrays = self.calculator.build_place_arrays(places)
         
-        for threshold_multiplier in radius_thresholds:
-            current_threshold = threshold_multiplier * max_radius
-            print(f"\n{'='*100}")
-            print(f"🔍 LAST POI SEARCH @ Threshold {threshold_multiplier*100:.0f}% = {current_threshold:.3f}km")
-            print(f"{'='*100}")
+        # Các điều kiện không phụ thuộc threshold → tính 1 lần cho tất cả POI (vector hóa)
+        dist_row = distance_matrix[current_pos, 1:]
+        dist_to_user = distance_matrix[1:, 0]
+        stay_times = self.calculator.stay_time_array(place_arrays)
+        
+        travel_time = dist_row * min_per_km
+        return_time = dist_to_user * min_per_km
+        total_time = (total_travel_time + travel_time) + (total_stay_time + stay_times) + return_time
+        
+        feasible = ~visited & (total_time <= max_time_minutes)
+        # validate for travel_time > 15 phút khi đi bộ
+        if transportation_mode == "WALKING":
+            feasible &= travel_time <= 15
+        
+        # Các check đắt (meal window, opening hours) chỉ chạy cho candidate đang được xét
+        # theo thứ tự score (2 pha: xếp hạng rẻ trước, validate sau); cache kết quả vì
+        # 1 POI có thể được xét lại ở threshold lớn hơn
+        time_check_cache: Dict[int, bool] = {}
+        
+        # Meal window đổi sang offset (timedelta) tính từ current_datetime 1 lần:
+        # start <= current_datetime + offset ⇔ start - current_datetime <= offset (chính xác
+        # tới microsecond) → mỗi candidate chỉ so sánh timedelta, không tạo datetime arrival
+        check_meal_window = bool(should_insert_restaurant_for_meal and current_datetime and meal_windows)
+        lunch_offsets = None
+        dinner_offsets = None
+        if check_meal_window:
+            if meal_windows.get('lunch'):
+                lunch_start, lunch_end = meal_windows['lunch']
+                lunch_offsets = (lunch_start - current_datetime, lunch_end - current_datetime)
+            if meal_windows.get('dinner'):
+                dinner_start, dinner_end = meal_windows['dinner']
+                dinner_offsets = (dinner_start - current_datetime, dinner_end - current_datetime)
+        
+        def passes_time_checks(i: int) -> bool:
+            cached = time_check_cache.get(i)
+            if cached is not None:
+                return cached
+            ok = True
+            offset_minutes = total_travel_time + total_stay_time + travel_time[i]
             
-            for i, place in enumerate(places):
-                reasons = []
-
-                travel_time = self.calculator.calculate_travel_time(
-                    distance_matrix[current_pos][i + 1],
-                    transportation_mode
-                )
-                # validate for travl_time > 10 
-                if travel_time > 15 and transportation_mode == "WALKING":  
-                    print(f"Travel time {travel_time} phút quá lớn → BỎ QUA {place.get('name')}")
-                    continue
-                
-                if i in visited:
-                    reasons.append("visited")
-                
-                # Logic lọc Restaurant cho POI cuối
-                if should_insert_restaurant_for_meal and place.get('category') == 'Restaurant':
-                    if current_datetime and meal_windows:
-                        travel_time_to_last = self.calculator.calculate_travel_time(
-                            distance_matrix[current_pos][i + 1],
-                            transportation_mode
-                        )
-                        arrival_at_last = current_datetime + timedelta(
-                            minutes=total_travel_time + total_stay_time + travel_time_to_last
-                        )
-                        
-                        in_lunch = False
-                        in_dinner = False
-                        
-                        if meal_windows.get('lunch'):
-                            lunch_start, lunch_end = meal_windows['lunch']
-                            if lunch_start <= arrival_at_last <= lunch_end:
-                                in_lunch = True
-                        
-                        if meal_windows.get('dinner'):
-                            dinner_start, dinner_end = meal_windows['dinner']
-                            if dinner_start <= arrival_at_last <= dinner_end:
-                                in_dinner = True
-                        
-                        if in_lunch and lunch_restaurant_inserted:
-                            reasons.append("lunch_already_inserted")
-                        if in_dinner and dinner_restaurant_inserted:
-                            reasons.append("dinner_already_inserted")
-                        if not in_lunch and not in_dinner:
-                            reasons.append("not_meal_time")
-                
-                # Kiểm tra khoảng cách đến user
-                dist_to_user = distance_matrix[i + 1][0]
-                if dist_to_user > current_threshold:
-                    reasons.append(f"far({dist_to_user:.3f}>{current_threshold:.3f})")
-                
-                # Kiểm tra availability
-                arrival_time = None
-                if current_datetime:
-                    travel_time_to_poi = self.calculator.calculate_travel_time(
-                        distance_matrix[current_pos][i + 1],
-                        transportation_mode
-                    )
-                    arrival_time = current_datetime + timedelta(
-                        minutes=total_travel_time + total_stay_time + travel_time_to_poi
-                    )
-                    if not self.validator.is_poi_available_at_time(place, arrival_time):
-                        reasons.append(f"closed@{arrival_time.strftime('%H:%M')}")
-                
-                # Kiểm tra thời gian khả thi
-                temp_travel = total_travel_time + self.calculator.calculate_travel_time(
-                    distance_matrix[current_pos][i + 1],
-                    transportation_mode
-                )
-                temp_stay = total_stay_time + self.calculator.get_stay_time_reduction(
-                    places[i].get("poi_type", ""),
-                    places[i].get("stay_time")
+            # Logic lọc Restaurant cho POI cuối: chỉ giữ Restaurant nếu arrival rơi vào
+            # meal window chưa được insert
+            if (check_meal_window
+                    and (is_restaurant[i] if is_restaurant is not None
+                         else places[i].get('category') == 'Restaurant')):
+                arrival_offset = timedelta(minutes=offset_minutes)
+                in_lunch = (
+                    lunch_offsets is not None
+                    and lunch_offsets[0] <= arrival_offset <= lunch_offsets[1]
                 )
-                return_time = self.calculator.calculate_travel_time(
-                    dist_to_user, transportation_mode
+                in_dinner = (
+                    dinner_offsets is not None
+                    and dinner_offsets[0] <= arrival_offset <= dinner_offsets[1]
                 )
-                total_time = temp_travel + temp_stay + return_time
-                
-                if total_time > max_time_minutes:
-                    reasons.append(f"time({total_time:.1f}>{max_time_minutes})")
-                
-                # Tính combined score nếu valid
-                combined = 0.0
-                if not reasons:
-                    combined = self.calculator.calculate_combined_score(
-                        place_idx=i,
-                        current_pos=current_pos,
-                        places=places,
-                        distance_matrix=distance_matrix,
-                        max_distance=max_distance,
-                        is_last=True
-                    )
                 
-                # In tất cả POI
-                status = "❌" if reasons else "✅"
-                print(
-                    f"{status} [{i:2d}] {place.get('name')[:45]:45s} | "
-                    f"dist={dist_to_user:.3f} | rate={place.get('rating',0):.3f} | "
-                    f"sim={place.get('score',0):.3f} | comb={combined:.4f} | "
-                    f"{','.join(reasons) if reasons else 'OK'}"
+                if (in_lunch and lunch_restaurant_inserted) or (in_dinner and dinner_restaurant_inserted):
+                    ok = False
+                elif not in_lunch and not in_dinner:
+                    ok = False
+            
+            # Kiểm tra availability (opening hours)
+            if ok and current_datetime:
+                ok = self.validator.is_poi_available_after(
+                    places[i], current_datetime, offset_minutes, float(place_arrays.stay_times[i])
                 )
-                
-                if reasons:
+            
+            time_check_cache[i] = ok
+            return ok
+        
+        # Combined score POI cuối (giống Calculator.score_last) + mask trong 1 lần gọi kernel
+        weights = RouteConfig.LAST_POI_WEIGHTS
+        combined = score_linear_candidates(
+            dist_to_user, place_arrays.scores, place_arrays.ratings, feasible,
+            float(max_distance), weights["distance"], weights["similarity"], weights["rating"]
+        )
+        
+        # Thử các threshold từ nhỏ đến lớn (bằng điểm → index nhỏ hơn trước → deterministic).
+        # Tới threshold sau nghĩa là mọi POI trong bán kính trước đều đã bị loại → chỉ cần
+        # xếp hạng "vành" POI mới vào bán kính. POI sort theo khoảng cách về user 1 lần,
+        # searchsorted cho ra vành [prev_count, count) của từng threshold.
+        by_distance = np.argsort(dist_to_user, kind="stable")
+        sorted_dist = dist_to_user[by_distance]
+        prev_count = 0
+        for threshold_multiplier in radius_thresholds:
+            current_threshold = threshold_multiplier * max_radius
+            count = int(np.searchsorted(sorted_dist, current_threshold, side="right"))
+            # Giữ thứ tự index tăng dần để tie-break giống xếp hạng trên toàn mảng
+            ring = np.sort(by_distance[prev_count:count])
+            prev_count = max(prev_count, count)
+            
+            for j in self.iter_ranked_candidates(combined[ring]):
+                best_last = int(ring[j])
+                if not passes_time_checks(best_last):
                     continue
-                
-                if combined > best_last_score or (
-                    combined == best_last_score and (best_last is None or i < best_last)
-                ):
-                    best_last_score = combined
-                    best_last = i
-                    print(f"    ⭐ NEW BEST (combined={combined:.4f})")
+                logger.debug(
+                    "🎯 Chọn POI cuối: [%d] %s (threshold=%.0f%% = %.3fkm, combined=%.4f)",
+                    best_last, places[best_last].get('name'),
+                    threshold_multiplier * 100, current_threshold, combined[best_last]
+                )
+                return best_last
             
-            if best_last is not None:
-                print(f"\n🎯 Chọn POI cuối: [{best_last}] {places[best_last].get('name')} (threshold={threshold_multiplier*100:.0f}%)")
-                break
+            logger.debug(
+                "🔍 LAST POI @ Threshold %.0f%% = %.3fkm: không có POI hợp lệ",
+                threshold_multiplier * 100, current_threshold
+            )
         
-        return best_last
+        return None
     
     def format_route_result(
         self,
         route: List[int],
         places: List[Dict[str, Any]],
-        distance_matrix: List[List[float]],
+        distance_matrix: np.ndarray,
         transportation_mode: str,
         max_distance: float,
         total_travel_time: float,
-        total_stay_time: float
+        total_stay_time: float,
+        place_arrays: Optional[PlaceArrays] = None,
+        route_legs: Optional[List[Tuple[float, float]]] = None
     ) -> Dict[str, Any]:
         """
         Format route thành cấu trúc JSON chuẩn để trả về cho client
@@ -518,6 +756,9 @@ class BaseRouteBuilder:
             max_distance: Khoảng cách lớn nhất (để normalize score)
             total_travel_time: Tổng thời gian di chuyển
             total_stay_time: Tổng thời gian lưu trú
+            place_arrays: PlaceArrays precompute (None = đọc từ dict)
+            route_legs: (travel_time, stay_time) của từng POI đã tính lúc build route
+                        (None = tính lại từ distance_matrix)
             
         Returns:
             Dict chứa:
@@ -532,29 +773,37 @@ class BaseRouteBuilder:
         """
         route_places = []
         prev_pos = 0
+        min_per_km = self.calculator.get_minutes_per_km(transportation_mode)
+        if place_arrays is None:
+            place_arrays = self.calculator.build_place_arrays(places)
+        scores, ratings = place_arrays.scores, place_arrays.ratings
         
         for i, place_idx in enumerate(route):
             place = places[place_idx]
-            travel_time = self.calculator.calculate_travel_time(
-                distance_matrix[prev_pos][place_idx + 1],
-                transportation_mode
-            )
-            stay_time = self.calculator.get_stay_time_reduction(
-                place.get("poi_type", ""),
-                place.get("stay_time")
-            )
+            if route_legs is not None:
+                travel_time, stay_time = route_legs[i]
+            else:
+                travel_time = distance_matrix[prev_pos, place_idx + 1] * min_per_km
+                stay_time = self.calculator.stay_time_at(place_arrays, place_idx)
             
-            is_first_poi = (i == 0)
-            is_last_poi = (i == len(route) - 1)
-            combined_score = self.calculator.calculate_combined_score(
-                place_idx=place_idx,
-                current_pos=prev_pos,
-                places=places,
-                distance_matrix=distance_matrix,
-                max_distance=max_distance,
-                is_first=is_first_poi,
-                is_last=is_last_poi
-            )
+            similarity = float(scores[place_idx])
+            rating = float(ratings[place_idx])
+            if i == 0:
+                combined_score = self.calculator.score_first(
+                    self.calculator.distance_score(distance_matrix[prev_pos, place_idx + 1], max_distance),
+                    similarity, rating
+                )
+            elif i == len(route) - 1:
+                # POI cuối: distance tính theo khoảng cách về user
+                combined_score = self.calculator.score_last(
+                    self.calculator.distance_score(distance_matrix[place_idx + 1, 0], max_distance),
+                    similarity, rating
+                )
+            else:
+                combined_score = self.calculator.score_middle(
+                    self.calculator.distance_score(distance_matrix[prev_pos, place_idx + 1], max_distance),
+                    similarity, rating
+                )
             
             route_places.append({
                 "place_id": place["id"],
@@ -569,8 +818,8 @@ class BaseRouteBuilder:
                 "lon": place["lon"],
                 "similarity": round(place["score"], 3),
                 "rating": round(float(place.get("rating") or 0.5), 3),
-                "combined_score": round(combined_score, 3),
-                "travel_time_minutes": round(travel_time, 1),
+                "combined_score": round(float(combined_score), 3),
+                "travel_time_minutes": round(float(travel_time), 1),
                 "stay_time_minutes": stay_time,
                 "open_hours": place.get("open_hours", [])
             })
@@ -578,6 +827,9 @@ class BaseRouteBuilder:
             prev_pos = place_idx + 1
         
         total_score = sum(places[idx]["score"] for idx in route)
+        # distance_matrix là ndarray → ép về float Python cho JSON response
+        total_travel_time = float(total_travel_time)
+        total_stay_time = float(total_stay_time)
         total_time = total_travel_time + total_stay_time
 
         # import json
@@ -18,12 +18,17 @@ Constants:
 Author: Kyanon Team
 Created: 2026-01
 """
+import logging
 from datetime import datetime, timedelta
 from typing import List, Dict, Any, Tuple, Optional
+import numpy as np
 from utils.time_utils import TimeUtils
 from .route_config import RouteConfig
+from .calculator import PlaceArrays
 from .route_builder_base import BaseRouteBuilder
 
+logger = logging.getLogger(__name__)
+
 class DurationRouteBuilder(BaseRouteBuilder):
     """
     Route Builder cho chế độ duration (TIME BUDGET, không cố định số POI)
@@ -56,6 +61,8 @@ class DurationRouteBuilder(BaseRouteBuilder):
         >>> print(f"Route có {len(route['places'])} POI")  # Có thể là 5, 6, 7...
     """
     
+    __slots__ = ()
+    
     TIME_THRESHOLD_FOR_LAST_POI = 0.3  # 30% thời gian còn lại
     
     def build_route(
@@ -66,8 +73,11 @@ class DurationRouteBuilder(BaseRouteBuilder):
         max_time_minutes: int,
         first_place_idx: Optional[int] = None,
         current_datetime: Optional[datetime] = None,
-        distance_matrix: Optional[List[List[float]]] = None,
-        max_distance: Optional[float] = None
+        distance_matrix: Optional[np.ndarray] = None,
+        max_distance: Optional[float] = None,
+        max_radius: Optional[float] = None,
+        meal_info: Optional[Dict[str, Any]] = None,
+        place_arrays: Optional[PlaceArrays] = None
     ) -> Optional[Dict[str, Any]]:
         """
         Xây dựng route DỰA TRÊN TIME BUDGET (số POI linh hoạt)
@@ -93,6 +103,9 @@ class DurationRouteBuilder(BaseRouteBuilder):
             current_datetime: Thời điểm bắt đầu
             distance_matrix: Ma trận khoảng cách (optional)
             max_distance: Max distance (optional)
+            max_radius: Khoảng cách xa nhất từ user đến POI (pre-computed, optional)
+            meal_info: Kết quả analyze_meal_requirements (pre-computed, optional)
+            place_arrays: PlaceArrays từ Calculator.build_place_arrays (pre-computed, optional)
             
         Returns:
             Dict chứa route info hoặc None nếu không feasible
@@ -121,24 +134,30 @@ class DurationRouteBuilder(BaseRouteBuilder):
         if category_counts:
             max_count_per_category = max(category_counts.values())
             if max_count_per_category <= 1:
-                print(f"⚠️ Số lượng POI quá ít (mỗi category <= 3): {category_counts}")
-                print("   → Không build route, trả về rỗng\n")
+                logger.debug("⚠️ Số lượng POI quá ít (mỗi category <= 3): %s", category_counts)
+                logger.debug("   → Không build route, trả về rỗng\n")
                 return None
         
         # ============================================================
         # BƯỚC 1: Xây dựng distance matrix (Ma trận khoảng cách)
         # ============================================================
         # Distance matrix: [user_location, poi1, poi2, ...]
-        # distance_matrix[i][j] = khoảng cách từ vị trí i đến vị trí j
+        # distance_matrix[i, j] = khoảng cách từ vị trí i đến vị trí j
         # i=0: user location, i=1,2,3...: các POI
         if distance_matrix is None:
             distance_matrix = self.geo.build_distance_matrix(user_location, places)
         
 
         if max_distance is None:
-            max_distance = max(max(row) for row in distance_matrix)
+            max_distance = float(distance_matrix.max())
+        
+        if max_radius is None:
+            max_radius = float(distance_matrix[0, 1:].max())
+        
+        min_per_km = self.calculator.get_minutes_per_km(transportation_mode)
         
-        max_radius = max(distance_matrix[0][1:])
+        if place_arrays is None:
+            place_arrays = self.calculator.build_place_arrays(places)
         
         # ============================================================
         # BƯỚC 2: Phân tích meal requirements (Yêu cầu bữa ăn)
@@ -148,24 +167,26 @@ class DurationRouteBuilder(BaseRouteBuilder):
         # - Không có "Cafe & Bakery" nhưng có "Restaurant" → Kiểm tra overlap với meal time
         # - Overlap >= 60 phút với lunch (11:00-14:00) hoặc dinner (17:00-20:00) → Cần chèn Restaurant
         # - Có "Cafe" (không phải "Cafe & Bakery") → Bật cafe-sequence
-        meal_info = self.analyze_meal_requirements(places, current_datetime, max_time_minutes)
+        if meal_info is None:
+            meal_info = self.analyze_meal_requirements(places, current_datetime, max_time_minutes)
         all_categories = meal_info["all_categories"]
         should_insert_restaurant_for_meal = meal_info["should_insert_restaurant_for_meal"]
         meal_windows = meal_info["meal_windows"]
         need_lunch_restaurant = meal_info["need_lunch_restaurant"]
         need_dinner_restaurant = meal_info["need_dinner_restaurant"]
         should_insert_cafe = meal_info.get("should_insert_cafe", False)
+        category_masks = meal_info.get("category_masks")
         
         # Print thông báo meal time overlap
         if should_insert_restaurant_for_meal:
-            print("\n" + "="*60)
-            print("🍽️  MEAL TIME ANALYSIS (Duration Mode)")
-            print("="*60)
+            logger.debug("\n" + "="*60)
+            logger.debug("🍽️  MEAL TIME ANALYSIS (Duration Mode)")
+            logger.debug("="*60)
             if need_lunch_restaurant:
-                print("✅ Overlap với LUNCH TIME (12:00-15:00) >= 60 phút")
+                logger.debug("✅ Overlap với LUNCH TIME (12:00-15:00) >= 60 phút")
             if need_dinner_restaurant:
-                print("✅ Overlap với DINNER TIME (18:30-20:00) >= 60 phút")
-            print("="*60 + "\n")
+                logger.debug("✅ Overlap với DINNER TIME (18:30-20:00) >= 60 phút")
+            logger.debug("="*60 + "\n")
         
         # ============================================================
         # BƯỚC 3: Chọn POI đầu tiên
@@ -179,7 +200,8 @@ class DurationRouteBuilder(BaseRouteBuilder):
         best_first, should_insert_cafe = self.select_first_poi(
             places, first_place_idx, distance_matrix, max_distance,
             transportation_mode, current_datetime, should_insert_restaurant_for_meal,
-            meal_windows, should_insert_cafe
+            meal_windows, should_insert_cafe, place_arrays=place_arrays,
+            category_masks=category_masks
         )
         
         if best_first is None:
@@ -189,21 +211,18 @@ class DurationRouteBuilder(BaseRouteBuilder):
         # BƯỚC 4: Khởi tạo route state (Trạng thái ban đầu)
         # ============================================================
         route = [best_first]  # Danh sách index POI trong route  # Danh sách index POI trong route
-        visited = {best_first}  # Set các POI đã dùng (tránh trùng lặp)
+        visited = np.zeros(len(places), dtype=bool)  # Bool mask các POI đã dùng (tránh trùng lặp)
+        visited[best_first] = True
         current_pos = best_first + 1  # Vị trí hiện tại trong distance_matrix (0=user, 1+=POI)
         
         # Tính travel time từ user → POI đầu và stay time tại POI đầu
-        travel_time = self.calculator.calculate_travel_time(
-            distance_matrix[0][best_first + 1],
-            transportation_mode
-        )
-        print("travel_time user → POI đầu:", travel_time, "phút")
-        stay_time = self.calculator.get_stay_time_reduction(
-            places[best_first].get("poi_type", ""),
-            places[best_first].get("stay_time")
-        )
+        travel_time = distance_matrix[0, best_first + 1] * min_per_km
+        logger.debug("travel_time user → POI đầu: %.1f phút", travel_time)
+        stay_time = self.calculator.stay_time_at(place_arrays, best_first)
         total_travel_time = travel_time  # Tổng travel time tích lũy
         total_stay_time = stay_time  # Tổng stay time tích lũy
+        # (travel_time, stay_time) của từng POI, dùng lại khi format kết quả
+        route_legs = [(travel_time, stay_time)]
         
         # Tính bearing (hướng di chuyển) từ user → POI đầu (dùng để tránh quay đầu nhiều)
         prev_bearing = self.geo.calculate_bearing(
@@ -229,21 +248,26 @@ class DurationRouteBuilder(BaseRouteBuilder):
         )
         
         # Print thông báo POI đầu
-        if should_insert_restaurant_for_meal:
+        if should_insert_restaurant_for_meal and logger.isEnabledFor(logging.DEBUG):
             first_poi = places[best_first]
             is_restaurant = first_poi.get('category') == 'Restaurant'
-            print("🔍 Kiểm tra POI đầu tiên:")
-            print(f"   - Tên: {first_poi.get('name', 'N/A')}")
-            print(f"   - Category: {first_poi.get('category', 'N/A')}")
+            logger.debug("🔍 Kiểm tra POI đầu tiên:")
+            logger.debug("   - Tên: %s", first_poi.get('name', 'N/A'))
+            logger.debug("   - Category: %s", first_poi.get('category', 'N/A'))
             if is_restaurant and (lunch_restaurant_inserted or dinner_restaurant_inserted):
-                print("   ✅ POI đầu là RESTAURANT trong meal time!")
+                logger.debug("   ✅ POI đầu là RESTAURANT trong meal time!")
                 if lunch_restaurant_inserted:
-                    print("      → Đã tính là Restaurant cho LUNCH")
+                    logger.debug("      → Đã tính là Restaurant cho LUNCH")
                 if dinner_restaurant_inserted:
-                    print("      → Đã tính là Restaurant cho DINNER")
+                    logger.debug("      → Đã tính là Restaurant cho DINNER")
             else:
-                print("   ℹ️  POI đầu KHÔNG phải Restaurant trong meal time")
-            print()
+                logger.debug("   ℹ️  POI đầu KHÔNG phải Restaurant trong meal time")
+        
+        # Mã hóa category thành int id 1 lần cho cả route (should_insert_cafe đã chốt)
+        category_codes = self.build_category_codes(
+            places, all_categories, should_insert_cafe,
+            meal_info.get("category_ids"), meal_info.get("food_type_ids")
+        )
         
         # ============================================================
         # BƯỚC 6: WHILE LOOP - Chọn POI giữa cho đến khi còn < 30% thời gian
@@ -263,7 +287,7 @@ class DurationRouteBuilder(BaseRouteBuilder):
             # Nếu thời gian còn lại < 30%, chuyển sang chọn điểm cuối
             # --- Check 2: Stop condition (còn < 30% thời gian) ---
             if remaining_time < max_time_minutes * self.TIME_THRESHOLD_FOR_LAST_POI:
-                print(f"⏰ Thời gian còn lại ({remaining_time:.1f}m) < 30% → Chọn POI cuối")
+                logger.debug("⏰ Thời gian còn lại (%.1fm) < 30%% → Chọn POI cuối", remaining_time)
                 break
             
             # --- Chọn POI tiếp theo với meal-priority và cafe-sequence ---
@@ -278,11 +302,11 @@ class DurationRouteBuilder(BaseRouteBuilder):
                 all_categories, category_sequence, should_insert_restaurant_for_meal,
                 meal_windows, need_lunch_restaurant, need_dinner_restaurant,
                 lunch_restaurant_inserted, dinner_restaurant_inserted,
-                should_insert_cafe, cafe_counter
+                should_insert_cafe, cafe_counter, category_codes, place_arrays
             )
             
             if best_next is None:
-                print(f"⚠️ Không tìm được POI phù hợp → Chọn POI cuối")
+                logger.debug("⚠️ Không tìm được POI phù hợp → Chọn POI cuối")
                 break
             
             # --- Lấy kết quả từ _select_middle_poi ---
@@ -292,14 +316,22 @@ class DurationRouteBuilder(BaseRouteBuilder):
             if best_next['target_meal_type']:
                 if best_next['target_meal_type'] == 'lunch':
                     lunch_restaurant_inserted = True
-                    print(f"🍽️  ✅ Đã chèn RESTAURANT cho LUNCH (POI #{len(route)+1}: {places[poi_idx].get('name', 'N/A')})")
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug(
+                            "🍽️  ✅ Đã chèn RESTAURANT cho LUNCH (POI #%d: %s)",
+                            len(route) + 1, places[poi_idx].get('name', 'N/A')
+                        )
                 elif best_next['target_meal_type'] == 'dinner':
                     dinner_restaurant_inserted = True
-                    print(f"🍽️  ✅ Đã chèn RESTAURANT cho DINNER (POI #{len(route)+1}: {places[poi_idx].get('name', 'N/A')})")
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug(
+                            "🍽️  ✅ Đã chèn RESTAURANT cho DINNER (POI #%d: %s)",
+                            len(route) + 1, places[poi_idx].get('name', 'N/A')
+                        )
             
             # --- Thêm POI vào route ---
             route.append(poi_idx)
-            visited.add(poi_idx)
+            visited[poi_idx] = True
             
             # --- Cập nhật category_sequence và cafe_counter ---
             # category_sequence: lịch sử category để xen kẽ
@@ -316,23 +348,18 @@ class DurationRouteBuilder(BaseRouteBuilder):
                     if best_next.get("reset_cafe_counter", False):
                         # Restaurant hoặc Cafe → reset counter (cả 2 đều là nơi dừng chân)
                         cafe_counter = 0
-                        print(f"   🍽️/☕ Chọn {selected_cat} (dừng chân) → Reset cafe_counter = 0")
+                        logger.debug("   🍽️/☕ Chọn %s (dừng chân) → Reset cafe_counter = 0", selected_cat)
                     else:
                         # POI khác → +1
                         cafe_counter += 1
-                        print(f"   📍 Chọn {selected_cat} → cafe_counter = {cafe_counter}")
+                        logger.debug("   📍 Chọn %s → cafe_counter = %d", selected_cat, cafe_counter)
             
             # --- Cập nhật total travel/stay time ---
-            travel_time = self.calculator.calculate_travel_time(
-                distance_matrix[current_pos][poi_idx + 1],
-                transportation_mode
-            )
-            stay_time = self.calculator.get_stay_time_reduction(
-                places[poi_idx].get("poi_type", ""),
-                places[poi_idx].get("stay_time")
-            )
+            travel_time = distance_matrix[current_pos, poi_idx + 1] * min_per_km
+            stay_time = self.calculator.stay_time_at(place_arrays, poi_idx)
             total_travel_time += travel_time
             total_stay_time += stay_time
+            route_legs.append((travel_time, stay_time))
             
             # --- Cập nhật bearing (hướng di chuyển) để tính angle penalty ---
             # Angle penalty: tránh quay đầu nhiều lần (di chuyển zigzag)
@@ -361,30 +388,23 @@ class DurationRouteBuilder(BaseRouteBuilder):
             places, visited, current_pos, distance_matrix, max_radius,
             transportation_mode, max_distance, total_travel_time, total_stay_time,
             max_time_minutes, current_datetime, should_insert_restaurant_for_meal,
-            meal_windows, lunch_restaurant_inserted, dinner_restaurant_inserted
+            meal_windows, lunch_restaurant_inserted, dinner_restaurant_inserted,
+            place_arrays, category_masks[0] if category_masks is not None else None
         )
         
         if best_last is not None:
             route.append(best_last)
-            travel_time = self.calculator.calculate_travel_time(
-                distance_matrix[current_pos][best_last + 1],
-                transportation_mode
-            )
-            stay_time = self.calculator.get_stay_time_reduction(
-                places[best_last].get("poi_type", ""),
-                places[best_last].get("stay_time")
-            )
+            travel_time = distance_matrix[current_pos, best_last + 1] * min_per_km
+            stay_time = self.calculator.stay_time_at(place_arrays, best_last)
             total_travel_time += travel_time
             total_stay_time += stay_time
+            route_legs.append((travel_time, stay_time))
             current_pos = best_last + 1
         
         # ============================================================
         # BƯỚC 8: Tính return time và validate time budget
         # ============================================================
-        return_time = self.calculator.calculate_travel_time(
-            distance_matrix[current_pos][0],
-            transportation_mode
-        )
+        return_time = distance_matrix[current_pos, 0] * min_per_km
         total_travel_time += return_time
         
         total_time = total_travel_time + total_stay_time
@@ -402,7 +422,8 @@ class DurationRouteBuilder(BaseRouteBuilder):
         #     json.dump(route, f, ensure_ascii=False, indent=4)
         return self.format_route_result(
             route, places, distance_matrix, transportation_mode,
-            max_distance, total_travel_time, total_stay_time
+            max_distance, total_travel_time, total_stay_time, place_arrays,
+            route_legs
         )
     
     def _select_middle_poi(
@@ -411,13 +432,20 @@ class DurationRouteBuilder(BaseRouteBuilder):
         current_datetime, prev_bearing, user_location, all_categories, category_sequence,
         should_insert_restaurant_for_meal, meal_windows, need_lunch_restaurant,
         need_dinner_restaurant, lunch_restaurant_inserted, dinner_restaurant_inserted,
-        should_insert_cafe: bool = False, cafe_counter: int = 0
+        should_insert_cafe: bool = False, cafe_counter: int = 0,
+        category_codes: Optional[Dict[str, Any]] = None,
+        place_arrays: Optional[PlaceArrays] = None
     ) -> Optional[Dict[str, Any]]:
         """Chọn POI giữa - hỗ trợ meal-priority và cafe-sequence insertion."""
         
-        def is_cafe_cat(cat: Optional[str]) -> bool:
-            # Category cố định từ UI: "Cafe" hoặc "Cafe & Bakery"
-            return cat == "Cafe"
+        # Category đã mã hóa thành int id (build 1 lần mỗi route) → filter bằng so sánh int
+        if category_codes is None:
+            category_codes = self.build_category_codes(places, all_categories, should_insert_cafe)
+        category_ids = category_codes["category_ids"]
+        category_to_id = category_codes["category_to_id"]
+        # Category cố định từ UI: "Restaurant", "Cafe" (-2: không có trong places → không POI nào khớp)
+        restaurant_id = category_to_id.get("Restaurant", -2)
+        cafe_id = category_to_id.get("Cafe", -2)
         
         # Kiểm tra meal time priority
         arrival_at_next = None
@@ -426,21 +454,21 @@ class DurationRouteBuilder(BaseRouteBuilder):
                 minutes=total_travel_time + total_stay_time
             )
         
-        should_prioritize_restaurant = False
-        target_meal_type = None
-        
+        # Arrival có rơi vào meal window chưa insert không (tính 1 lần, dùng cho cả
+        # meal priority và block cafe-sequence bên dưới)
+        in_lunch_window = False
+        in_dinner_window = False
         if meal_windows and arrival_at_next:
-            if meal_windows.get('lunch') and need_lunch_restaurant and not lunch_restaurant_inserted:
-                lunch_start, lunch_end = meal_windows['lunch']
-                if lunch_start <= arrival_at_next <= lunch_end:
-                    should_prioritize_restaurant = True
-                    target_meal_type = 'lunch'
-            
-            if not should_prioritize_restaurant and meal_windows.get('dinner') and need_dinner_restaurant and not dinner_restaurant_inserted:
-                dinner_start, dinner_end = meal_windows['dinner']
-                if dinner_start <= arrival_at_next <= dinner_end:
-                    should_prioritize_restaurant = True
-                    target_meal_type = 'dinner'
+            lunch_window = meal_windows.get('lunch')
+            if lunch_window and need_lunch_restaurant and not lunch_restaurant_inserted:
+                in_lunch_window = lunch_window[0] <= arrival_at_next <= lunch_window[1]
+            dinner_window = meal_windows.get('dinner')
+            if dinner_window and need_dinner_restaurant and not dinner_restaurant_inserted:
+                in_dinner_window = dinner_window[0] <= arrival_at_next <= dinner_window[1]
+        
+        # Lunch ưu tiên hơn dinner khi cả 2 cùng khớp
+        should_prioritize_restaurant = in_lunch_window or in_dinner_window
+        target_meal_type = 'lunch' if in_lunch_window else ('dinner' if in_dinner_window else None)
         
         # ============================================================
         # BƯỚC 1: Xác định category bắt buộc cho POI tiếp theo
@@ -459,10 +487,7 @@ class DurationRouteBuilder(BaseRouteBuilder):
         exclude_restaurant = should_insert_restaurant_for_meal
         
         if should_prioritize_restaurant:
-            has_restaurant_available = any(
-                p.get('category') == 'Restaurant' and i not in visited
-                for i, p in enumerate(places)
-            )
+            has_restaurant_available = bool(np.any((category_ids == restaurant_id) & ~visited))
             if has_restaurant_available:
                 required_category = 'Restaurant'
                 exclude_restaurant = False
@@ -477,27 +502,20 @@ class DurationRouteBuilder(BaseRouteBuilder):
         # NHƯNG: Meal time có priority cao hơn → block cafe-sequence khi trong meal window
         if should_insert_cafe and required_category is None:
             # Check xem có đang trong meal window không
-            in_meal_window = False
-            if meal_windows and arrival_at_next:
-                if meal_windows.get('lunch') and need_lunch_restaurant and not lunch_restaurant_inserted:
-                    lunch_start, lunch_end = meal_windows['lunch']
-                    if lunch_start <= arrival_at_next <= lunch_end:
-                        in_meal_window = True
-                        print(f"🍽️  Block cafe-sequence: Đang trong LUNCH window ({arrival_at_next.strftime('%H:%M')})")
-                
-                if meal_windows.get('dinner') and need_dinner_restaurant and not dinner_restaurant_inserted:
-                    dinner_start, dinner_end = meal_windows['dinner']
-                    if dinner_start <= arrival_at_next <= dinner_end:
-                        in_meal_window = True
-                        print(f"🍽️  Block cafe-sequence: Đang trong DINNER window ({arrival_at_next.strftime('%H:%M')})")
+            in_meal_window = in_lunch_window or in_dinner_window
+            if in_meal_window and logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    "🍽️  Block cafe-sequence: Đang trong %s window (%s)",
+                    "LUNCH" if in_lunch_window else "DINNER", arrival_at_next.strftime('%H:%M')
+                )
             
             # Chỉ chèn cafe khi KHÔNG trong meal window
             if not in_meal_window and cafe_counter >= 2:
-                # Trigger cafe-insert using sentinel 'CAFE' (so sánh bằng is_cafe_cat sau)
+                # Trigger cafe-insert using sentinel 'Cafe' (so sánh bằng cafe_id sau)
                 required_category = 'Cafe'
                 # exclude_restaurant  là ưu tiên lv1 nên cần false lại thì mới chèn được cafe
                 exclude_restaurant = False
-                print(f"☕ Cafe-sequence triggered: cafe_counter={cafe_counter} >= 2 → Chèn Cafe")
+                logger.debug("☕ Cafe-sequence triggered: cafe_counter=%d >= 2 → Chèn Cafe", cafe_counter)
         
         # ============================================================
         # BƯỚC 4: Xây dựng alternation_categories (xen kẽ category)
@@ -506,23 +524,22 @@ class DurationRouteBuilder(BaseRouteBuilder):
         # Lý do: Cafe chỉ được chèn theo sequence (sau 2 POI), không xen kẽ bình thường
         # Ví dụ: all_categories = ["Culture", "Nature", "Cafe", "Restaurant"]
         #        → alternation_categories = ["Culture", "Nature", "Restaurant"] (bỏ "Cafe")
-        alternation_categories = [
-            c for c in all_categories
-            if not (should_insert_cafe and is_cafe_cat(c))  # Bỏ "Cafe" nếu bật sequence
-        ] if all_categories else []
-        
-        # Debug: in ra để kiểm tra
-        print(f"🔍 DEBUG: all_categories={all_categories}")
-        print(f"🔍 DEBUG: should_insert_cafe={should_insert_cafe}")
-        print(f"🔍 DEBUG: alternation_categories={alternation_categories}")
-        print(f"🔍 DEBUG: cafe_counter={cafe_counter}")
+        # (đã build sẵn trong category_codes, cùng bảng next_category_id để tra category kế tiếp)
+        alternation_categories = category_codes["alternation_categories"]
+        
+        # Debug: in ra để kiểm tra (chỉ format khi bật DEBUG)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("🔍 DEBUG: all_categories=%s", all_categories)
+            logger.debug("🔍 DEBUG: should_insert_cafe=%s", should_insert_cafe)
+            logger.debug("🔍 DEBUG: alternation_categories=%s", alternation_categories)
+            logger.debug("🔍 DEBUG: cafe_counter=%d", cafe_counter)
 
         # Cách 2 cho dê hiểu
         # alternation_categories = []
 
         # if all_categories:
         #     for c in all_categories:
-        #         if should_insert_cafe and is_cafe_cat(c):
+        #         if should_insert_cafe and c == "Cafe":
         #             continue
         #         alternation_categories.append(c)
 
@@ -535,115 +552,70 @@ class DurationRouteBuilder(BaseRouteBuilder):
         # Ví dụ: alternation_categories = ["Culture", "Nature", "Restaurant"]
         #        category_sequence[-1] = "Nature" → chọn "Restaurant" (phần tử kế tiếp)
         if required_category is None and category_sequence and alternation_categories:
-            last_category = category_sequence[-1]  # Category POI vừa thêm
-            try:
-                # Tìm vị trí của last_category trong list alternation
-                current_idx = alternation_categories.index(last_category)
-                # Chọn phần tử kế tiếp (vòng quanh nếu hết list)
-                next_idx = (current_idx + 1) % len(alternation_categories)
-                required_category = alternation_categories[next_idx]
-            except ValueError:
-                # Nếu last_category không có trong alternation → chọn phần tử đầu
-                required_category = alternation_categories[0] if alternation_categories else None
+            # id của category POI vừa thêm (-1 nếu không có trong all_categories)
+            last_id = category_to_id.get(category_sequence[-1], -1)
+            # Tra bảng: id category kế tiếp (vòng quanh nếu hết list);
+            # last_category không có trong alternation → phần tử đầu
+            required_category = all_categories[category_codes["next_category_id"][last_id]]
+        
+        # id category bắt buộc (-1 = không ép category, -2 = không POI nào khớp)
+        required_id = category_to_id.get(required_category, -2) if required_category else -1
+        
+        # ============================================================
+        # BƯỚC 6: Tính score + filter số học cho tất cả candidates (1 lần gọi kernel)
+        # ============================================================
+        # Kernel xử lý: bỏ POI đã dùng, travel time > 15 phút khi đi bộ, vượt TIME BUDGET
+        # (travel đến POI + stay tại POI + quay về user > max_time) → score = -inf
+        # Các filter còn lại kiểm tra theo thứ tự score giảm dần, POI đầu tiên pass là POI tốt nhất
+        if place_arrays is None:
+            place_arrays = self.calculator.build_place_arrays(places)
+        base_stay_times = place_arrays.stay_times
+        scores = self.score_middle_candidates(
+            places, visited, current_pos, distance_matrix, max_distance,
+            transportation_mode, max_time_minutes, total_travel_time, total_stay_time,
+            prev_bearing, user_location, place_arrays
+        )
+        # Không cho 2 POI giống nhau cả 3 level food type đứng liền nhau (is_same_food_type)
+        food_type_ids = category_codes["food_type_ids"]
+        last_food_type = food_type_ids[route[-1]] if route else -1
+        min_per_km = self.calculator.get_minutes_per_km(transportation_mode)
+        
+        def is_available(i: int, place: Dict[str, Any]) -> bool:
+            # Kiểm tra opening hours (giờ mở cửa) tại thời điểm arrival
+            if not current_datetime:
+                return True
+            travel_time_to_poi = distance_matrix[current_pos, i + 1] * min_per_km
+            return self.validator.is_poi_available_after(
+                place, current_datetime, total_travel_time + total_stay_time + travel_time_to_poi,
+                float(base_stay_times[i])
+            )
         
         # ============================================================
-        # BƯỚC 6: Lọc candidates theo các điều kiện
+        # BƯỚC 7: Chọn POI tốt nhất theo các điều kiện
         # ============================================================
-        candidates = []
-        last_added_place = places[route[-1]] if route else None
-        
-        for i, place in enumerate(places):
-
-            travel_time = self.calculator.calculate_travel_time(
-                distance_matrix[current_pos][i + 1],
-                transportation_mode
-            )
-            # validate for travl_time > 10 
-            if travel_time > 15 and transportation_mode == "WALKING":  
-                print(f"Travel time {travel_time} phút quá lớn → BỎ QUA {place.get('name')}")
-                continue
-
-            # --- Filter 1: Bỏ POI đã dùng ---
-            if i in visited:
-                continue
+        # Thứ tự duyệt: combined score cao → thấp; nếu bằng nhau thì index nhỏ hơn (deterministic)
+        for i in self.iter_ranked_candidates(scores):
+            place = places[i]
             
-            # --- Filter 2: Loại Restaurant nếu exclude_restaurant = True ---
+            # --- Filter 1: Loại Restaurant nếu exclude_restaurant = True ---
             # (Đang giữ restaurant cho meal time)
-            if exclude_restaurant and place.get('category') == 'Restaurant':
+            if exclude_restaurant and category_ids[i] == restaurant_id:
                 continue
             
-            # --- Filter 3: Kiểm tra required_category (ép chọn loại POI) ---
-            # Nếu required_category == 'CAFE' thì match bằng substring (is_cafe_cat),
-            # ngược lại match bằng equality như trước
-            if required_category:
-                # Kiểm tra trường hợp đặc biệt khi yêu cầu là "Cafe" (xử lý khác với các category khác).
-                if required_category == 'Cafe':
-                    # Kiểm tra xem place có phải là cafe không bằng hàm is_cafe_cat  nếu ko thì bỏ qua nhảy qua POI tiếp thep
-                    if not is_cafe_cat(place.get('category')):
-                        continue
-                else:
-                    if place.get('category') != required_category:
-                        continue
+            # --- Filter 2: Kiểm tra required_category (ép chọn loại POI) ---
+            # So sánh int id thay cho string (required_category == 'Cafe' → required_id == cafe_id)
+            if required_id != -1 and category_ids[i] != required_id:
+                continue
             
-            # --- Filter 4: Tránh chọn 2 POI cùng loại đồ ăn liên tiếp ---
+            # --- Filter 3: Tránh chọn 2 POI cùng loại đồ ăn liên tiếp ---
             # Ví dụ: Phở → Bún chả (cùng Vietnamese food) → bỏ
-            if last_added_place and self.validator.is_same_food_type(last_added_place, place):
+            if last_food_type >= 0 and food_type_ids[i] == last_food_type:
                 continue
             
-            # --- Filter 5: Kiểm tra opening hours (giờ mở cửa) ---
-            if current_datetime:
-                travel_time_to_poi = self.calculator.calculate_travel_time(
-                    distance_matrix[current_pos][i + 1],
-                    transportation_mode
-                )
-                arrival_time = current_datetime + timedelta(
-                    minutes=total_travel_time + total_stay_time + travel_time_to_poi
-                )
-                # Bỏ nếu POI đóng cửa vào thời điểm arrival
-                if not self.validator.is_poi_available_at_time(place, arrival_time):
-                    continue
-            
-            # --- Tính combined score (70% similarity + 30% distance + angle penalty) ---
-            combined = self.calculator.calculate_combined_score(
-                place_idx=i,
-                current_pos=current_pos,
-                places=places,
-                distance_matrix=distance_matrix,
-                max_distance=max_distance,
-                prev_bearing=prev_bearing,
-                user_location=user_location
-            )
-            
-            # --- Filter 6: Kiểm tra TIME BUDGET ---
-            # Phải đủ thời gian: (travel đến POI) + (stay tại POI) + (quay về user) <= max_time
-            temp_travel = total_travel_time + self.calculator.calculate_travel_time(
-                distance_matrix[current_pos][i + 1],
-                transportation_mode
-            )
-            temp_stay = total_stay_time + self.calculator.get_stay_time_reduction(
-                places[i].get("poi_type", ""),
-                places[i].get("stay_time")
-            )
-            estimated_return = self.calculator.calculate_travel_time(
-                distance_matrix[i + 1][0],  # Từ POI này về user
-                transportation_mode
-            )
-            
-            # Bỏ nếu vượt quá time budget
-            if temp_travel + temp_stay + estimated_return > max_time_minutes:
+            # --- Filter 4: Bỏ nếu POI đóng cửa vào thời điểm arrival ---
+            if not is_available(i, place):
                 continue
             
-            # ✅ POI này pass tất cả filters → thêm vào candidates
-            candidates.append((i, combined))
-        
-        # ============================================================
-        # BƯỚC 7: Chọn POI tốt nhất từ candidates
-        # ============================================================
-        if candidates:
-            # Sort: combined score cao → thấp; nếu bằng nhau thì index nhỏ hơn (deterministic)
-            candidates.sort(key=lambda x: (-x[1], x[0]))
-            best_idx = candidates[0][0]
-            
             # ============================================================
             # BƯỚC 8: Xác định có reset cafe_counter hay không
             # ============================================================
@@ -651,18 +623,18 @@ class DurationRouteBuilder(BaseRouteBuilder):
             # - "Restaurant" hoặc "Cafe" → reset về 0 (cả 2 đều là nơi dừng chân nghỉ ngơi)
             # - "Cafe & Bakery" → KHÔNG reset (thuộc Food & Local Flavours, xen kẽ bình thường)
             # - Category khác → caller sẽ tăng cafe_counter += 1
-            selected_cat = places[best_idx].get('category')
+            selected_cat = place.get('category')
             if selected_cat in ("Restaurant", "Cafe"):
                 # Trả về flag reset_cafe_counter=True → caller sẽ set cafe_counter = 0
                 return {
-                    'index': best_idx,
+                    'index': i,
                     'target_meal_type': target_meal_type,
                     'reset_cafe_counter': True
                 }
             
             # Category khác → caller sẽ tăng cafe_counter += 1
             return {
-                'index': best_idx,
+                'index': i,
                 'target_meal_type': target_meal_type
             }
         
@@ -670,87 +642,35 @@ class DurationRouteBuilder(BaseRouteBuilder):
         # BƯỚC 9: FALLBACK - Nếu không tìm được candidate với required_category
         # ============================================================
         # Bỏ constraint category và tìm lại (vẫn tôn trọng exclude_restaurant và các filter khác)
-        if not candidates and required_category:
-            for i, place in enumerate(places):
-
-                travel_time = self.calculator.calculate_travel_time(
-                    distance_matrix[current_pos][i + 1],
-                    transportation_mode
-                )
-                # validate for travl_time > 8 
-                if travel_time > 15 and transportation_mode == "WALKING":  
-                    print(f"Travel time {travel_time} phút quá lớn → BỎ QUA {place.get('name')}")
-                    continue
-
+        if required_category:
+            for i in self.iter_ranked_candidates(scores):
+                place = places[i]
                 
-                if i in visited:
-                    continue
-                
-                if exclude_restaurant and place.get('category') == 'Restaurant':
+                if exclude_restaurant and category_ids[i] == restaurant_id:
                     continue
                 
                 # QUAN TRỌNG: Fallback vẫn phải tôn trọng cafe-sequence
                 # KHÔNG được chọn "Cafe" nếu should_insert_cafe=True và cafe_counter < 2
-                if should_insert_cafe and is_cafe_cat(place.get('category')) and cafe_counter < 2:
+                if should_insert_cafe and category_ids[i] == cafe_id and cafe_counter < 2:
                     continue
                 
-                if last_added_place and self.validator.is_same_food_type(last_added_place, place):
+                if last_food_type >= 0 and food_type_ids[i] == last_food_type:
                     continue
                 
-                if current_datetime:
-                    travel_time_to_poi = self.calculator.calculate_travel_time(
-                        distance_matrix[current_pos][i + 1],
-                        transportation_mode
-                    )
-                    arrival_time = current_datetime + timedelta(
-                        minutes=total_travel_time + total_stay_time + travel_time_to_poi
-                    )
-                    if not self.validator.is_poi_available_at_time(place, arrival_time):
-                        continue
-                
-                combined = self.calculator.calculate_combined_score(
-                    place_idx=i,
-                    current_pos=current_pos,
-                    places=places,
-                    distance_matrix=distance_matrix,
-                    max_distance=max_distance,
-                    prev_bearing=prev_bearing,
-                    user_location=user_location
-                )
-                
-                temp_travel = total_travel_time + self.calculator.calculate_travel_time(
-                    distance_matrix[current_pos][i + 1],
-                    transportation_mode
-                )
-                temp_stay = total_stay_time + self.calculator.get_stay_time_reduction(
-                    places[i].get("poi_type", ""),
-                    places[i].get("stay_time")
-                )
-                estimated_return = self.calculator.calculate_travel_time(
-                    distance_matrix[i + 1][0],
-                    transportation_mode
-                )
-                
-                if temp_travel + temp_stay + estimated_return > max_time_minutes:
+                if not is_available(i, place):
                     continue
                 
-                candidates.append((i, combined))
-            
-            if candidates:
-                candidates.sort(key=lambda x: (-x[1], x[0]))
-                best_idx = candidates[0][0]
-                
                 # Check category để xác định reset_cafe_counter (giống logic chính)
-                selected_cat = places[best_idx].get('category')
+                selected_cat = place.get('category')
                 if selected_cat in ("Restaurant", "Cafe"):
                     return {
-                        'index': best_idx,
+                        'index': i,
                         'target_meal_type': None,
                         'reset_cafe_counter': True
                     }
                 
                 return {
-                    'index': best_idx,
+                    'index': i,
                     'target_meal_type': None
                 }
         
@@ -14,11 +14,16 @@ với số lượng POI được chỉ định trước (target_places).
 Author: Kyanon Team
 Created: 2026-01
 """
+import logging
 from datetime import datetime, timedelta
 from typing import List, Dict, Any, Tuple, Optional
+import numpy as np
 from utils.time_utils import TimeUtils
+from .calculator import PlaceArrays
 from .route_builder_base import BaseRouteBuilder
 
+logger = logging.getLogger(__name__)
+
 class TargetRouteBuilder(BaseRouteBuilder):
     """
     Route Builder cho chế độ target_places (số POI cố định)
@@ -48,6 +53,8 @@ class TargetRouteBuilder(BaseRouteBuilder):
         ... )
     """
     
+    __slots__ = ()
+    
     def build_route(
         self,
         user_location: Tuple[float, float],
@@ -57,8 +64,11 @@ class TargetRouteBuilder(BaseRouteBuilder):
         target_places: int,
         first_place_idx: Optional[int] = None,
         current_datetime: Optional[datetime] = None,
-        distance_matrix: Optional[List[List[float]]] = None,
-        max_distance: Optional[float] = None
+        distance_matrix: Optional[np.ndarray] = None,
+        max_distance: Optional[float] = None,
+        max_radius: Optional[float] = None,
+        meal_info: Optional[Dict[str, Any]] = None,
+        place_arrays: Optional[PlaceArrays] = None
     ) -> Optional[Dict[str, Any]]:
         """
         Xây dựng route với SỐ LƯỢNG POI CỐ ĐỊNH (target_places)
@@ -85,6 +95,9 @@ class TargetRouteBuilder(BaseRouteBuilder):
             current_datetime: Thời điểm bắt đầu (để validate opening hours)
             distance_matrix: Ma trận khoảng cách (pre-computed, optional)
             max_distance: Max distance trong matrix (pre-computed, optional)
+            max_radius: Khoảng cách xa nhất từ user đến POI (pre-computed, optional)
+            meal_info: Kết quả analyze_meal_requirements (pre-computed, optional)
+            place_arrays: PlaceArrays từ Calculator.build_place_arrays (pre-computed, optional)
             
         Returns:
             Dict chứa:
@@ -111,8 +124,8 @@ class TargetRouteBuilder(BaseRouteBuilder):
         if category_counts:
             max_count_per_category = max(category_counts.values())
             if max_count_per_category <= 1:
-                print(f"⚠️ Số lượng POI quá ít (mỗi category <= 3): {category_counts}")
-                print("   → Không build route, trả về rỗng\n")
+                logger.debug("⚠️ Số lượng POI quá ít (mỗi category <= 3): %s", category_counts)
+                logger.debug("   → Không build route, trả về rỗng\n")
                 return None
         
         # 1. Xây dựng distance matrix (nếu chưa có)
@@ -120,35 +133,44 @@ class TargetRouteBuilder(BaseRouteBuilder):
             distance_matrix = self.geo.build_distance_matrix(user_location, places)
         
         if max_distance is None:
-            max_distance = max(max(row) for row in distance_matrix)
+            max_distance = float(distance_matrix.max())
+        
+        if max_radius is None:
+            max_radius = float(distance_matrix[0, 1:].max())
+        
+        min_per_km = self.calculator.get_minutes_per_km(transportation_mode)
         
-        max_radius = max(distance_matrix[0][1:])
+        if place_arrays is None:
+            place_arrays = self.calculator.build_place_arrays(places)
         
         # 2. Phân tích meal requirements
-        meal_info = self.analyze_meal_requirements(places, current_datetime, max_time_minutes)
+        if meal_info is None:
+            meal_info = self.analyze_meal_requirements(places, current_datetime, max_time_minutes)
         all_categories = meal_info["all_categories"]
         should_insert_restaurant_for_meal = meal_info["should_insert_restaurant_for_meal"]
         meal_windows = meal_info["meal_windows"]
         need_lunch_restaurant = meal_info["need_lunch_restaurant"]
         need_dinner_restaurant = meal_info["need_dinner_restaurant"]
         should_insert_cafe = meal_info.get("should_insert_cafe", False)
+        category_masks = meal_info.get("category_masks")
         
         # Print thông báo meal time overlap
         if should_insert_restaurant_for_meal:
-            print("\n" + "="*60)
-            print("🍽️  MEAL TIME ANALYSIS (Target Mode)")
-            print("="*60)
+            logger.debug("\n" + "="*60)
+            logger.debug("🍽️  MEAL TIME ANALYSIS (Target Mode)")
+            logger.debug("="*60)
             if need_lunch_restaurant:
-                print("✅ Overlap với LUNCH TIME (11:00-14:00) >= 60 phút")
+                logger.debug("✅ Overlap với LUNCH TIME (11:00-14:00) >= 60 phút")
             if need_dinner_restaurant:
-                print("✅ Overlap với DINNER TIME (17:00-20:00) >= 60 phút")
-            print("="*60 + "\n")
+                logger.debug("✅ Overlap với DINNER TIME (17:00-20:00) >= 60 phút")
+            logger.debug("="*60 + "\n")
         
         # 3. Chọn điểm đầu tiên
         best_first, should_insert_cafe = self.select_first_poi(
             places, first_place_idx, distance_matrix, max_distance,
             transportation_mode, current_datetime, should_insert_restaurant_for_meal,
-            meal_windows, should_insert_cafe
+            meal_windows, should_insert_cafe, place_arrays=place_arrays,
+            category_masks=category_masks
         )
         
         if best_first is None:
@@ -156,19 +178,16 @@ class TargetRouteBuilder(BaseRouteBuilder):
       
         # Khởi tạo route
         route = [best_first]
-        visited = {best_first}
+        visited = np.zeros(len(places), dtype=bool)
+        visited[best_first] = True
         current_pos = best_first + 1
         
-        travel_time = self.calculator.calculate_travel_time(
-            distance_matrix[0][best_first + 1],
-            transportation_mode
-        )
-        stay_time = self.calculator.get_stay_time_reduction(
-            places[best_first].get("poi_type", ""),
-            places[best_first].get("stay_time")
-        )
+        travel_time = distance_matrix[0, best_first + 1] * min_per_km
+        stay_time = self.calculator.stay_time_at(place_arrays, best_first)
         total_travel_time = travel_time
         total_stay_time = stay_time
+        # (travel_time, stay_time) của từng POI, dùng lại khi format kết quả
+        route_legs = [(travel_time, stay_time)]
         
         prev_bearing = self.geo.calculate_bearing(
             user_location[0], user_location[1],
@@ -186,21 +205,26 @@ class TargetRouteBuilder(BaseRouteBuilder):
         )
         
         # Print thông báo POI đầu
-        if should_insert_restaurant_for_meal:
+        if should_insert_restaurant_for_meal and logger.isEnabledFor(logging.DEBUG):
             first_poi = places[best_first]
             is_restaurant = first_poi.get('category') == 'Restaurant'
-            print("🔍 Kiểm tra POI đầu tiên:")
-            print(f"   - Tên: {first_poi.get('name', 'N/A')}")
-            print(f"   - Category: {first_poi.get('category', 'N/A')}")
+            logger.debug("🔍 Kiểm tra POI đầu tiên:")
+            logger.debug("   - Tên: %s", first_poi.get('name', 'N/A'))
+            logger.debug("   - Category: %s", first_poi.get('category', 'N/A'))
             if is_restaurant and (lunch_restaurant_inserted or dinner_restaurant_inserted):
-                print("   ✅ POI đầu là RESTAURANT trong meal time!")
+                logger.debug("   ✅ POI đầu là RESTAURANT trong meal time!")
                 if lunch_restaurant_inserted:
-                    print("      → Đã tính là Restaurant cho LUNCH")
+                    logger.debug("      → Đã tính là Restaurant cho LUNCH")
                 if dinner_restaurant_inserted:
-                    print("      → Đã tính là Restaurant cho DINNER")
+                    logger.debug("      → Đã tính là Restaurant cho DINNER")
             else:
-                print("   ℹ️  POI đầu KHÔNG phải Restaurant trong meal time")
-            print()
+                logger.debug("   ℹ️  POI đầu KHÔNG phải Restaurant trong meal time")
+        
+        # Mã hóa category thành int id 1 lần cho cả route (should_insert_cafe đã chốt)
+        category_codes = self.build_category_codes(
+            places, all_categories, should_insert_cafe,
+            meal_info.get("category_ids"), meal_info.get("food_type_ids")
+        )
         
         # 4. Chọn các POI giữa (target_places - 2)
         for step in range(target_places - 2):
@@ -211,7 +235,7 @@ class TargetRouteBuilder(BaseRouteBuilder):
                 all_categories, category_sequence, should_insert_restaurant_for_meal,
                 meal_windows, need_lunch_restaurant, need_dinner_restaurant,
                 lunch_restaurant_inserted, dinner_restaurant_inserted,
-                should_insert_cafe, cafe_counter
+                should_insert_cafe, cafe_counter, category_codes, place_arrays
             )
             
             if best_next is None:
@@ -224,14 +248,22 @@ class TargetRouteBuilder(BaseRouteBuilder):
             if best_next['target_meal_type']:
                 if best_next['target_meal_type'] == 'lunch':
                     lunch_restaurant_inserted = True
-                    print(f"🍽️  ✅ Đã chèn RESTAURANT cho LUNCH (POI #{len(route)+1}: {places[poi_idx].get('name', 'N/A')})")
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug(
+                            "🍽️  ✅ Đã chèn RESTAURANT cho LUNCH (POI #%d: %s)",
+                            len(route) + 1, places[poi_idx].get('name', 'N/A')
+                        )
                 elif best_next['target_meal_type'] == 'dinner':
                     dinner_restaurant_inserted = True
-                    print(f"🍽️  ✅ Đã chèn RESTAURANT cho DINNER (POI #{len(route)+1}: {places[poi_idx].get('name', 'N/A')})")
+                    if logger.isEnabledFor(logging.DEBUG):
+                        logger.debug(
+                            "🍽️  ✅ Đã chèn RESTAURANT cho DINNER (POI #%d: %s)",
+                            len(route) + 1, places[poi_idx].get('name', 'N/A')
+                        )
             
             # Thêm POI vào route
             route.append(poi_idx)
-            visited.add(poi_idx)
+            visited[poi_idx] = True
             
             if 'category' in places[poi_idx]:
                 category_sequence.append(places[poi_idx].get('category'))
@@ -251,16 +283,11 @@ class TargetRouteBuilder(BaseRouteBuilder):
             if 'updated_cafe_counter' in best_next:
                 cafe_counter = best_next['updated_cafe_counter']
             
-            travel_time = self.calculator.calculate_travel_time(
-                distance_matrix[current_pos][poi_idx + 1],
-                transportation_mode
-            )
-            stay_time = self.calculator.get_stay_time_reduction(
-                places[poi_idx].get("poi_type", ""),
-                places[poi_idx].get("stay_time")
-            )
+            travel_time = distance_matrix[current_pos, poi_idx + 1] * min_per_km
+            stay_time = self.calculator.stay_time_at(place_arrays, poi_idx)
             total_travel_time += travel_time
             total_stay_time += stay_time
+            route_legs.append((travel_time, stay_time))
             
             # Cập nhật bearing
             prev_place = places[route[-2]] if len(route) >= 2 else None
@@ -283,28 +310,21 @@ class TargetRouteBuilder(BaseRouteBuilder):
             places, visited, current_pos, distance_matrix, max_radius,
             transportation_mode, max_distance, total_travel_time, total_stay_time,
             max_time_minutes, current_datetime, should_insert_restaurant_for_meal,
-            meal_windows, lunch_restaurant_inserted, dinner_restaurant_inserted
+            meal_windows, lunch_restaurant_inserted, dinner_restaurant_inserted,
+            place_arrays, category_masks[0] if category_masks is not None else None
         )
         
         if best_last is not None:
             route.append(best_last)
-            travel_time = self.calculator.calculate_travel_time(
-                distance_matrix[current_pos][best_last + 1],
-                transportation_mode
-            )
-            stay_time = self.calculator.get_stay_time_reduction(
-                places[best_last].get("poi_type", ""),
-                places[best_last].get("stay_time")
-            )
+            travel_time = distance_matrix[current_pos, best_last + 1] * min_per_km
+            stay_time = self.calculator.stay_time_at(place_arrays, best_last)
             total_travel_time += travel_time
             total_stay_time += stay_time
+            route_legs.append((travel_time, stay_time))
             current_pos = best_last + 1
         
         # 6. Thêm thời gian quay về user
-        return_time = self.calculator.calculate_travel_time(
-            distance_matrix[current_pos][0],
-            transportation_mode
-        )
+        return_time = distance_matrix[current_pos, 0] * min_per_km
         total_travel_time += return_time
         
         total_time = total_travel_time + total_stay_time
@@ -314,7 +334,8 @@ class TargetRouteBuilder(BaseRouteBuilder):
         # 7. Format kết quả
         return self.format_route_result(
             route, places, distance_matrix, transportation_mode,
-            max_distance, total_travel_time, total_stay_time
+            max_distance, total_travel_time, total_stay_time, place_arrays,
+            route_legs
         )
     
     def _select_middle_poi(
@@ -323,13 +344,20 @@ class TargetRouteBuilder(BaseRouteBuilder):
         current_datetime, prev_bearing, user_location, all_categories, category_sequence,
         should_insert_restaurant_for_meal, meal_windows, need_lunch_restaurant,
         need_dinner_restaurant, lunch_restaurant_inserted, dinner_restaurant_inserted,
-        should_insert_cafe: bool = False, cafe_counter: int = 0
+        should_insert_cafe: bool = False, cafe_counter: int = 0,
+        category_codes: Optional[Dict[str, Any]] = None,
+        place_arrays: Optional[PlaceArrays] = None
     ) -> Optional[Dict[str, Any]]:
         """Chọn POI giữa với logic xen kẽ category, meal priority và cafe-sequence"""
         
-        def is_cafe_cat(cat: Optional[str]) -> bool:
-            # CHỈ "Cafe" trigger cafe-sequence, "Cafe & Bakery" xen kẽ bình thường
-            return cat == "Cafe"
+        if category_codes is None:
+            category_codes = self.build_category_codes(places, all_categories, should_insert_cafe)
+        category_ids = category_codes["category_ids"]
+        category_to_id = category_codes["category_to_id"]
+        # CHỈ "Cafe" trigger cafe-sequence, "Cafe & Bakery" xen kẽ bình thường
+        # (-2: category không có trong places → không POI nào khớp)
+        restaurant_id = category_to_id.get("Restaurant", -2)
+        cafe_id = category_to_id.get("Cafe", -2)
         
         # Kiểm tra meal time priority
         arrival_at_next = None
@@ -338,31 +366,28 @@ class TargetRouteBuilder(BaseRouteBuilder):
                 minutes=total_travel_time + total_stay_time
             )
         
-        should_prioritize_restaurant = False
-        target_meal_type = None
-        
+        # Arrival có rơi vào meal window chưa insert không (tính 1 lần, dùng cho cả
+        # meal priority và block cafe-sequence bên dưới)
+        in_lunch_window = False
+        in_dinner_window = False
         if meal_windows and arrival_at_next:
-            if meal_windows.get('lunch') and need_lunch_restaurant and not lunch_restaurant_inserted:
-                lunch_start, lunch_end = meal_windows['lunch']
-                if lunch_start <= arrival_at_next <= lunch_end:
-                    should_prioritize_restaurant = True
-                    target_meal_type = 'lunch'
-            
-            if not should_prioritize_restaurant and meal_windows.get('dinner') and need_dinner_restaurant and not dinner_restaurant_inserted:
-                dinner_start, dinner_end = meal_windows['dinner']
-                if dinner_start <= arrival_at_next <= dinner_end:
-                    should_prioritize_restaurant = True
-                    target_meal_type = 'dinner'
+            lunch_window = meal_windows.get('lunch')
+            if lunch_window and need_lunch_restaurant and not lunch_restaurant_inserted:
+                in_lunch_window = lunch_window[0] <= arrival_at_next <= lunch_window[1]
+            dinner_window = meal_windows.get('dinner')
+            if dinner_window and need_dinner_restaurant and not dinner_restaurant_inserted:
+                in_dinner_window = dinner_window[0] <= arrival_at_next <= dinner_window[1]
+        
+        # Lunch ưu tiên hơn dinner khi cả 2 cùng khớp
+        should_prioritize_restaurant = in_lunch_window or in_dinner_window
+        target_meal_type = 'lunch' if in_lunch_window else ('dinner' if in_dinner_window else None)
         
         # Xác định category bắt buộc
         required_category = None
         exclude_restaurant = should_insert_restaurant_for_meal
         
         if should_prioritize_restaurant:
-            has_restaurant_available = any(
-                p.get('category') == 'Restaurant' and i not in visited
-                for i, p in enumerate(places)
-            )
+            has_restaurant_available = bool(np.any((category_ids == restaurant_id) & ~visited))
             if has_restaurant_available:
                 required_category = 'Restaurant'
                 exclude_restaurant = False
@@ -373,205 +398,104 @@ class TargetRouteBuilder(BaseRouteBuilder):
         # NHƯNG: Không chèn cafe nếu đang trong meal window (meal priority cao nhất)
         if should_insert_cafe and required_category is None:
             # Check xem có đang trong meal window không
-            in_meal_window = False
-            if meal_windows and arrival_at_next:
-                if meal_windows.get('lunch') and need_lunch_restaurant and not lunch_restaurant_inserted:
-                    lunch_start, lunch_end = meal_windows['lunch']
-                    if lunch_start <= arrival_at_next <= lunch_end:
-                        in_meal_window = True
-                        print(f"🍽️  Block cafe-sequence: Đang trong LUNCH window ({arrival_at_next.strftime('%H:%M')})")
-                
-                if meal_windows.get('dinner') and need_dinner_restaurant and not dinner_restaurant_inserted:
-                    dinner_start, dinner_end = meal_windows['dinner']
-                    if dinner_start <= arrival_at_next <= dinner_end:
-                        in_meal_window = True
-                        print(f"🍽️  Block cafe-sequence: Đang trong DINNER window ({arrival_at_next.strftime('%H:%M')})")
+            in_meal_window = in_lunch_window or in_dinner_window
+            if in_meal_window and logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    "🍽️  Block cafe-sequence: Đang trong %s window (%s)",
+                    "LUNCH" if in_lunch_window else "DINNER", arrival_at_next.strftime('%H:%M')
+                )
             
             # Chỉ chèn cafe khi KHÔNG trong meal window
             if not in_meal_window and cafe_counter >= 2:
                 # Tìm category cafe khả dụng
-                cafe_categories = []
-                for i, p in enumerate(places):
-                    if i in visited:
-                        continue
-                    cat = p.get('category')
-                    if is_cafe_cat(cat):
-                        cafe_categories.append(cat)
+                has_cafe_available = bool(np.any((category_ids == cafe_id) & ~visited))
                 
-                if cafe_categories:
-                    required_category = cafe_categories[0]
+                if has_cafe_available:
+                    required_category = "Cafe"
                     exclude_restaurant = False
-                    print(f"☕ Cafe-sequence triggered: cafe_counter={cafe_counter} >= 2 → Chèn Cafe")
-        
-        # Loại cafe khỏi alternation khi cafe-sequence bật
-        alternation_categories = [
-            c for c in all_categories
-            if not (should_insert_cafe and is_cafe_cat(c))
-        ] if all_categories else []
-        
-        # Nếu chưa có required_category, dùng alternation (skip cafe nếu đang quản lý sequence)
-        if required_category is None and category_sequence and alternation_categories:
-            last_category = category_sequence[-1]
-            try:
-                current_idx = alternation_categories.index(last_category)
-                next_idx = (current_idx + 1) % len(alternation_categories)
-                required_category = alternation_categories[next_idx]
-            except ValueError:
-                required_category = alternation_categories[0] if alternation_categories else None
-        
-        # Tìm candidates với category yêu cầu
-        candidates = []
-        last_added_place = places[route[-1]] if route else None
-        
-        for i, place in enumerate(places):
-
-            travel_time = self.calculator.calculate_travel_time(
-                distance_matrix[current_pos][i + 1],
-                transportation_mode
+                    logger.debug("☕ Cafe-sequence triggered: cafe_counter=%d >= 2 → Chèn Cafe", cafe_counter)
+        
+        # Nếu chưa có required_category, dùng alternation (cafe đã bị loại khỏi
+        # alternation nếu đang quản lý sequence) - tra bảng next_category_id thay cho list.index
+        if required_category is None and category_sequence and category_codes["alternation_categories"]:
+            last_id = category_to_id.get(category_sequence[-1], -1)
+            required_category = all_categories[category_codes["next_category_id"][last_id]]
+        
+        # id category bắt buộc (-1 = không ép category, -2 = không POI nào khớp)
+        required_id = category_to_id.get(required_category, -2) if required_category else -1
+        
+        # Tính combined score + filter số học (visited, travel time, time budget) cho
+        # tất cả POI trong 1 lần gọi kernel, sau đó duyệt theo score giảm dần
+        if place_arrays is None:
+            place_arrays = self.calculator.build_place_arrays(places)
+        base_stay_times = place_arrays.stay_times
+        scores = self.score_middle_candidates(
+            places, visited, current_pos, distance_matrix, max_distance,
+            transportation_mode, max_time_minutes, total_travel_time, total_stay_time,
+            prev_bearing, user_location, place_arrays
+        )
+        # Không cho 2 POI giống nhau cả 3 level food type đứng liền nhau (is_same_food_type)
+        food_type_ids = category_codes["food_type_ids"]
+        last_food_type = food_type_ids[route[-1]] if route else -1
+        min_per_km = self.calculator.get_minutes_per_km(transportation_mode)
+        
+        def is_available(i: int, place: Dict[str, Any]) -> bool:
+            if not current_datetime:
+                return True
+            travel_time_to_poi = distance_matrix[current_pos, i + 1] * min_per_km
+            return self.validator.is_poi_available_after(
+                place, current_datetime, total_travel_time + total_stay_time + travel_time_to_poi,
+                float(base_stay_times[i])
             )
-            # validate for travl_time > 10 
-            if travel_time > 15 and transportation_mode == "WALKING":  
-                print(f"Travel time {travel_time} phút quá lớn → BỎ QUA {place.get('name')}")
-                continue
-
-            if i in visited:
-                continue
+        
+        # Tìm POI tốt nhất với category yêu cầu
+        for i in self.iter_ranked_candidates(scores):
+            place = places[i]
             
-            if exclude_restaurant and place.get('category') == 'Restaurant':
+            if exclude_restaurant and category_ids[i] == restaurant_id:
                 continue
             
-            if required_category and place.get('category') != required_category:
+            if required_id != -1 and category_ids[i] != required_id:
                 continue
             
-            if last_added_place and self.validator.is_same_food_type(last_added_place, place):
+            if last_food_type >= 0 and food_type_ids[i] == last_food_type:
                 continue
             
-            if current_datetime:
-                travel_time_to_poi = self.calculator.calculate_travel_time(
-                    distance_matrix[current_pos][i + 1],
-                    transportation_mode
-                )
-                arrival_time = current_datetime + timedelta(
-                    minutes=total_travel_time + total_stay_time + travel_time_to_poi
-                )
-                if not self.validator.is_poi_available_at_time(place, arrival_time):
-                    continue
-            
-            combined = self.calculator.calculate_combined_score(
-                place_idx=i,
-                current_pos=current_pos,
-                places=places,
-                distance_matrix=distance_matrix,
-                max_distance=max_distance,
-                prev_bearing=prev_bearing,
-                user_location=user_location
-            )
-            
-            # Kiểm tra thời gian khả thi
-            temp_travel = total_travel_time + self.calculator.calculate_travel_time(
-                distance_matrix[current_pos][i + 1],
-                transportation_mode
-            )
-            temp_stay = total_stay_time + self.calculator.get_stay_time_reduction(
-                places[i].get("poi_type", ""),
-                places[i].get("stay_time")
-            )
-            estimated_return = self.calculator.calculate_travel_time(
-                distance_matrix[i + 1][0],
-                transportation_mode
-            )
-            
-            if temp_travel + temp_stay + estimated_return > max_time_minutes:
+            if not is_available(i, place):
                 continue
             
-            candidates.append((i, combined))
-        
-        # Chọn POI tốt nhất
-        if candidates:
-            candidates.sort(key=lambda x: (-x[1], x[0]))
-            best_idx = candidates[0][0]
-            
             # 🔄 Reset cafe_counter khi chọn Restaurant hoặc Cafe (cả 2 đều là nơi dừng chân)
             # "Cafe & Bakery" KHÔNG reset - thuộc Food & Local Flavours, xen kẽ bình thường
-            selected_cat = places[best_idx].get('category')
+            selected_cat = place.get('category')
             if selected_cat in ("Restaurant", "Cafe"):
                 # Restaurant/Cafe → reset cafe_counter về 0
                 return {
-                    'index': best_idx,
+                    'index': i,
                     'target_meal_type': target_meal_type,
                     'reset_cafe_counter': True
                 }
             
             return {
-                'index': best_idx,
+                'index': i,
                 'target_meal_type': target_meal_type
             }
         
         # Nếu không tìm thấy với category yêu cầu, bỏ qua category constraint và tìm lại
-        if not candidates and required_category:
-            for i, place in enumerate(places):
-
-                travel_time = self.calculator.calculate_travel_time(
-                    distance_matrix[current_pos][i + 1],
-                    transportation_mode
-                )
-                # validate for travl_time > 15 
-                if travel_time > 15 and transportation_mode == "WALKING":  
-                    print(f"Travel time {travel_time} phút quá lớn → BỎ QUA {place.get('name')}")
-                    continue
-
-                if i in visited:
-                    continue
+        if required_category:
+            for i in self.iter_ranked_candidates(scores):
+                place = places[i]
                 
-                if exclude_restaurant and place.get('category') == 'Restaurant':
+                if exclude_restaurant and category_ids[i] == restaurant_id:
                     continue
                 
-                if last_added_place and self.validator.is_same_food_type(last_added_place, place):
+                if last_food_type >= 0 and food_type_ids[i] == last_food_type:
                     continue
                 
-                if current_datetime:
-                    travel_time_to_poi = self.calculator.calculate_travel_time(
-                        distance_matrix[current_pos][i + 1],
-                        transportation_mode
-                    )
-                    arrival_time = current_datetime + timedelta(
-                        minutes=total_travel_time + total_stay_time + travel_time_to_poi
-                    )
-                    if not self.validator.is_poi_available_at_time(place, arrival_time):
-                        continue
-                
-                combined = self.calculator.calculate_combined_score(
-                    place_idx=i,
-                    current_pos=current_pos,
-                    places=places,
-                    distance_matrix=distance_matrix,
-                    max_distance=max_distance,
-                    prev_bearing=prev_bearing,
-                    user_location=user_location
-                )
-                
-                temp_travel = total_travel_time + self.calculator.calculate_travel_time(
-                    distance_matrix[current_pos][i + 1],
-                    transportation_mode
-                )
-                temp_stay = total_stay_time + self.calculator.get_stay_time_reduction(
-                    places[i].get("poi_type", ""),
-                    places[i].get("stay_time")
-                )
-                estimated_return = self.calculator.calculate_travel_time(
-                    distance_matrix[i + 1][0],
-                    transportation_mode
-                )
-                
-                if temp_travel + temp_stay + estimated_return > max_time_minutes:
+                if not is_available(i, place):
                     continue
                 
-                candidates.append((i, combined))
-            
-            if candidates:
-                candidates.sort(key=lambda x: (-x[1], x[0]))
                 return {
-                    'index': candidates[0][0],
+                    'index': i,
                     'target_meal_type': None
                 }
         
@@ -0,0 +1,68 @@
+"""
+Route Worker
+Entry point chạy build_routes trong process con (ProcessPoolExecutor)
+
+Process con chỉ nhận tham số của build_routes (không pickle RouteBuilder cùng state của nó)
+và tự tạo RouteBuilder riêng (1 lần / process).
+"""
+from typing import List, Dict, Any, Optional
+
+# Các field của place mà route builder thực sự đọc (chọn POI, validate, format response)
+ROUTE_PLACE_FIELDS = (
+    "id", "name", "lat", "lon", "score", "rating", "category",
+    "poi_type", "poi_type_clean", "main_subcategory", "specialization",
+    "address", "stay_time", "open_hours"
+)
+
+# RouteBuilder của process hiện tại (tạo lazy ở lần gọi đầu)
+_builder = None
+
+
+def slim_places(places: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Chỉ giữ các field trong ROUTE_PLACE_FIELDS của mỗi place trước khi pickle sang process con
+
+    Place từ semantic search mang nhiều field không dùng cho route (mô tả, metadata, ...);
+    bỏ bớt giúp giảm số byte pickle. Field không có trong place gốc vẫn không có
+    (giữ nguyên giá trị mặc định của các lệnh .get()).
+
+    Args:
+        places: Danh sách địa điểm gốc
+
+    Returns:
+        Danh sách dict mới chỉ chứa các field cần thiết
+    """
+    return [{key: place[key] for key in ROUTE_PLACE_FIELDS if key in place} for place in places]
+
+
+def get_worker_builder():
+    """
+    Lấy RouteBuilder của process hiện tại (tạo 1 lần, dùng lại cho mọi lần gọi)
+
+    Chỉ dùng trong process con của pool: mỗi worker chạy tuần tự từng task nên
+    state của Calculator (stay_time_reduction) không bị dùng chung giữa các request.
+    """
+    global _builder
+    if _builder is None:
+        # Import lazy: route_builder.py import module này
+        from .route_builder import RouteBuilder
+        _builder = RouteBuilder()
+    return _builder
+
+
+def init_worker() -> None:
+    """Initializer của ProcessPoolExecutor: tạo sẵn RouteBuilder khi worker khởi động"""
+    get_worker_builder()
+
+
+def build_routes_in_worker(**kwargs) -> List[Dict[str, Any]]:
+    """
+    Gọi RouteBuilder.build_routes trong process hiện tại
+
+    Args:
+        **kwargs: Tham số của RouteBuilder.build_routes (phải pickle được)
+
+    Returns:
+        List các routes tối ưu
+    """
+    return get_worker_builder().build_routes(**kwargs)
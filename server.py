@@ -145,10 +145,18 @@ async def startup_event():
     )
     await vector_store.initialize_async()
     
-    # 6. Khởi tạo services với async resources + shared vector_store & embedder
+    # 6. Process pool cho route building (chỉ khi ROUTE_PROCESS_WORKERS > 0, tạo 1 lần cho cả server)
+    process_pool = None
+    if Config.ROUTE_PROCESS_WORKERS > 0:
+        from radius_logic.route import RouteBuilder
+        process_pool = RouteBuilder.create_executor(Config.ROUTE_PROCESS_WORKERS)
+        print(f"✅ Route process pool started ({Config.ROUTE_PROCESS_WORKERS} workers)")
+    
+    # 7. Khởi tạo services với async resources + shared vector_store & embedder
     route_api_module._route_service_instance = RouteService(
         db_pool=db_pool,
         redis_client=redis_client,
+        process_pool=process_pool,
         vector_store=vector_store,
         embedder=embedder
     )
@@ -186,6 +194,12 @@ async def shutdown_event():
         if vector_store and vector_store.client:
             await vector_store.client.close()
             print("✅ Qdrant client closed")
+        
+        # Đóng process pool build route (nếu có)
+        process_pool = route_api_module._route_service_instance.route_service.process_pool
+        if process_pool is not None:
+            process_pool.shutdown(wait=True, cancel_futures=True)
+            print("✅ Route process pool closed")
     
     await close_db_pool()
     await close_redis_client()
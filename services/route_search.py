@@ -3,7 +3,7 @@ Route Search Service
 Kết hợp search + xây dựng lộ trình tối ưu + Quản lý POI replacement
 """
 import time
-from datetime import datetime
+from datetime import datetime, timedelta
 from typing import Optional, Dict, Any
 from concurrent.futures import ProcessPoolExecutor
 import asyncpg
@@ -12,6 +12,8 @@ from services.spatial_search import SpatialSearch
 from services.cache_search import CacheSearch
 from radius_logic.route import RouteBuilder
 from radius_logic.replace_poi import POIUpdateService
+from radius_logic.route.route_config import RouteConfig
+from utils.time_utils import TimeUtils
 from uuid import UUID
 
 class RouteSearch(SpatialSearch):
@@ -364,9 +366,6 @@ class RouteSearch(SpatialSearch):
                 next_poi_data = await self.cache_service.get_poi_data(next_poi_id)
             
             # 9. Format top 3 POI candidates với đầy đủ thông tin
-            from radius_logic.route.route_config import RouteConfig
-            from utils.time_utils import TimeUtils
-            
             transportation_mode = all_routes_metadata.get('transportation_mode', 'DRIVING')
             formatted_candidates = []
             
@@ -424,7 +423,6 @@ class RouteSearch(SpatialSearch):
                 # Thêm arrival_time và opening_hours_today nếu có current_datetime
                 if current_datetime and prev_poi_data:
                     # Tính arrival_time = current_datetime + travel_time
-                    from datetime import timedelta
                     arrival_time = current_datetime + timedelta(minutes=travel_time_minutes)
                     formatted_poi['arrival_time'] = arrival_time.strftime('%Y-%m-%d %H:%M:%S')
                     
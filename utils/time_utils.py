@@ -2,6 +2,7 @@
 Time Utilities
 Xử lý logic liên quan đến thời gian mở cửa của POI
 """
+import functools
 from datetime import datetime, timedelta
 from typing import List, Dict, Any, Optional, Tuple
 
@@ -20,6 +21,13 @@ class TimeUtils:
         'Sunday': 6
     }
     
+    # Tên ngày theo weekday() (Monday=0) → thay cho strftime('%A') trong các hàm check
+    DAY_NAMES = ('Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday')
+    
+    # Số microsecond trong 1 phút / 1 ngày
+    _US_PER_MINUTE = 60 * 1_000_000
+    _US_PER_DAY = 24 * 60 * _US_PER_MINUTE
+    
     @staticmethod
     def parse_time(time_str: str) -> Tuple[int, int]:
         """
@@ -31,10 +39,21 @@ class TimeUtils:
         Returns:
             Tuple (hour, minute)
         """
+        if not isinstance(time_str, str):
+            return 0, 0
+        return TimeUtils._parse_time_str(time_str)
+    
+    @staticmethod
+    @functools.lru_cache(maxsize=2048)
+    def _parse_time_str(time_str: str) -> Tuple[int, int]:
+        """
+        parse_time cho chuỗi (có cache): các mốc 'HH:MM' trong open_hours lặp lại rất nhiều
+        giữa các POI và các lần check opening hours → không split/int lại mỗi lần
+        """
         try:
             hour, minute = map(int, time_str.split(':'))
             return hour, minute
-        except:
+        except ValueError:
             return 0, 0
     
     @staticmethod
@@ -165,15 +184,76 @@ class TimeUtils:
         # Tính thời điểm rời đi
         departure_datetime = arrival_datetime + timedelta(minutes=stay_minutes)
         
-        # Kiểm tra xem có chuyển ngày không
-        is_cross_midnight = departure_datetime.date() != arrival_datetime.date()
+        return TimeUtils._has_enough_time(
+            open_hours,
+            arrival_datetime.weekday(),
+            TimeUtils.time_to_minutes(arrival_datetime.hour, arrival_datetime.minute),
+            departure_datetime.weekday(),
+            TimeUtils.time_to_minutes(departure_datetime.hour, departure_datetime.minute),
+            departure_datetime.date() != arrival_datetime.date()
+        )
+    
+    @staticmethod
+    def has_enough_time_to_stay_after(
+        open_hours: List[Dict[str, Any]],
+        start_datetime: datetime,
+        offset_minutes: float,
+        stay_minutes: float
+    ) -> bool:
+        """
+        Giống has_enough_time_to_stay với arrival = start_datetime + offset_minutes,
+        nhưng tính ngày/phút bằng số nguyên microsecond thay vì tạo datetime
+        (dùng trong vòng lặp chọn POI)
         
-        # Lấy tên ngày arrival và departure
-        arrival_day_name = arrival_datetime.strftime('%A')
-        departure_day_name = departure_datetime.strftime('%A')
+        Args:
+            open_hours: Danh sách giờ mở cửa
+            start_datetime: Thời điểm bắt đầu route
+            offset_minutes: Số phút từ start_datetime đến lúc tới POI
+            stay_minutes: Thời gian tham quan (phút)
+            
+        Returns:
+            True nếu có đủ thời gian (arrival + stay đều trong giờ mở cửa)
+        """
+        if not open_hours:
+            return True  # Không có thông tin → giả sử luôn mở
         
-        arrival_minutes = TimeUtils.time_to_minutes(arrival_datetime.hour, arrival_datetime.minute)
-        departure_minutes = TimeUtils.time_to_minutes(departure_datetime.hour, departure_datetime.minute)
+        # Microsecond tính từ 00:00 của ngày start_datetime (timedelta làm tròn giống phép cộng datetime)
+        start_us = (
+            (start_datetime.hour * 60 + start_datetime.minute) * TimeUtils._US_PER_MINUTE
+            + start_datetime.second * 1_000_000 + start_datetime.microsecond
+        )
+        arrival_us = start_us + timedelta(minutes=offset_minutes) // timedelta(microseconds=1)
+        departure_us = arrival_us + timedelta(minutes=stay_minutes) // timedelta(microseconds=1)
+        
+        arrival_day, arrival_rem = divmod(arrival_us, TimeUtils._US_PER_DAY)
+        departure_day, departure_rem = divmod(departure_us, TimeUtils._US_PER_DAY)
+        start_weekday = start_datetime.weekday()
+        
+        return TimeUtils._has_enough_time(
+            open_hours,
+            (start_weekday + arrival_day) % 7,
+            arrival_rem // TimeUtils._US_PER_MINUTE,
+            (start_weekday + departure_day) % 7,
+            departure_rem // TimeUtils._US_PER_MINUTE,
+            departure_day != arrival_day
+        )
+    
+    @staticmethod
+    def _has_enough_time(
+        open_hours: List[Dict[str, Any]],
+        arrival_weekday: int,
+        arrival_minutes: int,
+        departure_weekday: int,
+        departure_minutes: int,
+        is_cross_midnight: bool
+    ) -> bool:
+        """
+        Logic chung của has_enough_time_to_stay: so sánh arrival/departure (weekday, phút
+        trong ngày) với opening hours
+        """
+        # Lấy tên ngày arrival và departure
+        arrival_day_name = TimeUtils.DAY_NAMES[arrival_weekday]
+        departure_day_name = TimeUtils.DAY_NAMES[departure_weekday]
         
         # Trường hợp 1: KHÔNG qua ngày mới (cùng ngày)
         if not is_cross_midnight: